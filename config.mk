@@ -17,6 +17,7 @@ PYLIBDIR = ${ROOT}/lib/gencode_icedb
 # programs
 faUcscToGencode = ${BINDIR}/faUcscToGencode
 genePredIntrons = ${BINDIR}/genePredIntrons
+ensemblGencodeDbLoad = ${BINDIR}/ensemblGencodeDbLoad
 icedbLoadPslAligns = ${BINDIR}/icedbLoadPslAligns
 rslEncodeDccQuery = ${BINDIR}/rslEncodeDccQuery
 rslGencodeCollectNovel = ${BINDIR}/rslGencodeCollectNovel
@@ -34,12 +35,14 @@ rslStarSjOutSplit = ${BINDIR}/rslStarSjOutSplit
 rslArrayExpressSourceLoad = ${BINDIR}/rslArrayExpressSourceLoad
 tslGbffGetProblemCases = ${BINDIR}/tslGbffGetProblemCases
 tslGenbankProblemCasesLoad = ${BINDIR}/tslGenbankProblemCasesLoad
+tslClassifySupport = ${BINDIR}/tslClassifySupport
 tslCollectSupport = ${BINDIR}/tslCollectSupport
 tslCollectSupportFinishJobs = ${BINDIR}/tslCollectSupportFinishJobs
 tslCollectSupportMkJobs = ${BINDIR}/tslCollectSupportMkJobs
 tslGetEnsemblRnaAligns = ${BINDIR}/tslGetEnsemblRnaAligns
 tslGetUcscRnaAligns = ${BINDIR}/tslGetUcscRnaAligns
 tslLoadAlignEvid = ${BINDIR}/tslLoadAlignEvid
+tslLoadEvidFeatures = ${BINDIR}/tslLoadEvidFeatures
 ucscGencodeDbLoad = ${BINDIR}/ucscGencodeDbLoad
 
 
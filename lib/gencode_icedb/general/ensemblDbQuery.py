@@ -19,7 +19,9 @@ mysqlOps.mySqlSetErrorOnWarn()
 
 
 def _query(conn, dataCls, sql, args=None):
-    cur = conn.cursor(cursorclass=MySQLdb.cursors.DictCursor)
+    # server-side cursor streams rows rather than buffering the whole result;
+    # results must be consumed before the next query on the connection.
+    cur = conn.cursor(cursorclass=MySQLdb.cursors.SSDictCursor)
     try:
         cur.execute(sql, args)
         for row in cur:
@@ -40,6 +42,17 @@ def _ensureList(strOrList):
         return strOrList
 
 
+def _chunks(ids):
+    "split list of ids into chunks for IN queries"
+    for i in range(0, len(ids), _maxSetSelect):
+        yield ids[i:i + _maxSetSelect]
+
+
+def _stableIds(ids):
+    "stable ids without versions, which can be used with stable_id indexes"
+    return [i.split('.')[0] for i in ids]
+
+
 ####################################################################################################
 class EnsemblGeneIdRec(namedtuple("EnsemblGeneRec",
                                   ("geneDbId",
@@ -56,7 +69,7 @@ SELECT
     concat(g.stable_id, ".", g.version) AS geneId
 FROM
     gene AS g
-    LEFT JOIN seq_region AS sr ON (sr.seq_region_id = t.seq_region_id)
+    LEFT JOIN seq_region AS sr ON (sr.seq_region_id = g.seq_region_id)
 WHERE (g.source NOT IN ("LRG database")) {extrawhere};"""
 
 
@@ -66,10 +79,10 @@ def ensemblGeneIdRecQuery(conn, coords=None):
     args = None
     if coords is not None:
         if coords.start is None:
-            extrawhere = "AND (chrom = %s)"
+            extrawhere = "AND (sr.name = %s)"
             args = (coords.name,)
         else:
-            extrawhere = "AND (chrom = %s) AND (t.seq_region_end > %s) AND (t.seq_region_start-1 < %s)"
+            extrawhere = "AND (sr.name = %s) AND (g.seq_region_end > %s) AND (g.seq_region_start-1 < %s)"
             args = (coords.name, coords.start, coords.end)
 
     yield from _query(conn, EnsemblGeneIdRec,
@@ -127,24 +140,49 @@ def _idSqlInClause(idField, ids):
     return "({} IN ({}))".format(idField, ','.join(len(ids) * ['%s']))
 
 
+def _versionedIdQuery(conn, tblAlias, ids):
+    """query EnsemblTransRec by versioned gene or transcript ids in chunks.
+    The stable_id is included in the query so that an index can be used"""
+    for chunk in _chunks(ids):
+        clause = " AND {} AND {}".format(_idSqlInClause('{}.stable_id'.format(tblAlias), chunk),
+                                         _idSqlInClause('concat({0}.stable_id, ".", {0}.version)'.format(tblAlias), chunk))
+        yield from _query(conn, EnsemblTransRec,
+                          _ensemblTransRecSelect.format(extrawhere=clause),
+                          tuple(_stableIds(chunk)) + tuple(chunk))
+
+
 def ensemblTransRecByTransQuery(conn, transIds):
     """Select EnsemblGeneTrans records for a transcript ids or list of transcript ids.
     """
-    transIds = _ensureList(transIds)
-    clause = " AND ({})".format(_idSqlInClause('concat(t.stable_id, ".", t.version)', transIds))
-    yield from _query(conn, EnsemblTransRec,
-                      _ensemblTransRecSelect.format(extrawhere=clause),
-                      tuple(transIds))
+    yield from _versionedIdQuery(conn, "t", list(_ensureList(transIds)))
 
 
 def ensemblTransRecByGeneQuery(conn, geneIds):
     """Select EnsemblGeneTrans records for a gene id or list of gene ids.
     """
-    geneIds = _ensureList(geneIds)
-    clause = " AND ({})".format(_idSqlInClause('concat(g.stable_id, ".", g.version)', geneIds))
+    yield from _versionedIdQuery(conn, "g", list(_ensureList(geneIds)))
+
+
+def ensemblAllTransRecQuery(conn):
+    """Generator of EnsemblGeneTrans records for all transcripts in the database.
+    """
     yield from _query(conn, EnsemblTransRec,
-                      _ensemblTransRecSelect.format(extrawhere=clause),
-                      tuple(geneIds))
+                      _ensemblTransRecSelect.format(extrawhere=" AND (t.transcript_id IS NOT NULL)"))
+
+
+def ensemblTransRecByRangeQuery(conn, chrom, start=None, end=None):
+    """Select EnsemblGeneTrans records for transcripts overlapping a range,
+    or all transcripts on chrom if start and end are None.
+    """
+    if start is None:
+        extrawhere = " AND (sr.name = %s)"
+        args = (chrom,)
+    else:
+        extrawhere = " AND (sr.name = %s) AND (t.seq_region_end > %s) AND (t.seq_region_start-1 < %s)"
+        args = (chrom, start, end)
+    yield from _query(conn, EnsemblTransRec,
+                      _ensemblTransRecSelect.format(extrawhere=extrawhere),
+                      args)
 
 
 ####################################################################################################
@@ -178,14 +216,21 @@ WHERE {extrawhere};
 def ensemblExonRecQuery(conn, transcriptDbIds):
     """Select EnsemblExonRec records for a list of transcripts.
     """
-    for i in range(0, len(transcriptDbIds), _maxSetSelect):
-        args = tuple(transcriptDbIds[i:_maxSetSelect])
+    for chunk in _chunks(transcriptDbIds):
+        args = tuple(chunk)
         extrawhere = "(et.transcript_id IN ({}))".format(",".join(len(args) * ["%s"]))
         yield from _query(conn, EnsemblExonRec,
                           _ensemblExonRecSelect.format(extrawhere=extrawhere),
                           args)
 
 
+def ensemblAllExonRecQuery(conn):
+    """Generator of EnsemblExonRec records for all transcripts in the database.
+    """
+    yield from _query(conn, EnsemblExonRec,
+                      _ensemblExonRecSelect.format(extrawhere="TRUE"))
+
+
 ####################################################################################################
 class EnsemblTransAttrRec(namedtuple("EnsemblTransAttrRec",
                                      ("transcriptDbId", "code", "value"))):
@@ -215,14 +260,21 @@ WHERE (atyp.code IN ("Frameshift", "mRNA_start_NF", "mRNA_end",
 def ensemblTransAttrRecQuery(conn, transDbIds):
     """Select EnsemblTransAttrRec records for a list of transcript.
     """
-    for i in range(0, len(transDbIds), _maxSetSelect):
-        args = tuple(transDbIds[i:_maxSetSelect])
+    for chunk in _chunks(transDbIds):
+        args = tuple(chunk)
         extrawhere = " AND ta.transcript_id IN ({})".format(",".join(len(args) * ["%s"]))
         yield from _query(conn, EnsemblTransAttrRec,
                           _ensemblTransAttrRecSelect.format(extrawhere=extrawhere),
                           args)
 
 
+def ensemblAllTransAttrRecQuery(conn):
+    """Generator of EnsemblTransAttrRec records for all transcripts in the database.
+    """
+    yield from _query(conn, EnsemblTransAttrRec,
+                      _ensemblTransAttrRecSelect.format(extrawhere=""))
+
+
 ####################################################################################################
 # Select that generates Coords objects of PAR
 _ensemblParCoordsRecSelect = """
@@ -230,7 +282,7 @@ SELECT
     sr.name AS name,
     ae.seq_region_start-1 AS start,
     ae.seq_region_end AS end,
-    sr.length AS size,
+    sr.length AS size
 FROM
     assembly_exception AS ae
     LEFT JOIN seq_region AS sr ON (sr.seq_region_id = ae.seq_region_id)
@@ -264,21 +316,27 @@ def _makeTrans(transRec, exonRecs, attrRecs):
                              tuple(sorted(attrRecs, key=lambda a: (a.code, a.value))))
 
 
-def _buildTrans(conn, transRecs):
-    # per-transcript data
-    transDbIds = [transRec.transcriptDbId for transRec in transRecs]
-    exonRecs = defaultdict(list)  # by transcript id
-    for exonRec in ensemblExonRecQuery(conn, transDbIds):
-        exonRecs[exonRec.transcriptDbId].append(exonRec)
-    attrRecs = defaultdict(list)  # by transcript id
-    for attrRec in ensemblTransAttrRecQuery(conn, transDbIds):
-        attrRecs[attrRec.transcriptDbId].append(attrRec)
-
-    # pull all together
-    return [_makeTrans(transRec, exonRecs[transRec.transcriptDbId], attrRecs[transRec.transcriptDbId])
+def ensemblTranscriptJoin(transRecs, exonRecs, attrRecs):
+    """join EnsemblTransRec, EnsemblExonRec, and EnsemblTransAttrRec records
+    in memory to create a list of EnsemblTranscript in the order of transRecs"""
+    exonRecsByTrans = defaultdict(list)
+    for exonRec in exonRecs:
+        exonRecsByTrans[exonRec.transcriptDbId].append(exonRec)
+    attrRecsByTrans = defaultdict(list)
+    for attrRec in attrRecs:
+        attrRecsByTrans[attrRec.transcriptDbId].append(attrRec)
+    return [_makeTrans(transRec, exonRecsByTrans[transRec.transcriptDbId], attrRecsByTrans[transRec.transcriptDbId])
             for transRec in transRecs]
 
 
+def _buildTrans(conn, transRecs):
+    # per-transcript data, queried for all transcripts in chunks and joined here
+    transDbIds = sorted(set([transRec.transcriptDbId for transRec in transRecs]))
+    return ensemblTranscriptJoin(transRecs,
+                                 list(ensemblExonRecQuery(conn, transDbIds)),
+                                 list(ensemblTransAttrRecQuery(conn, transDbIds)))
+
+
 def ensemblTransQuery(conn, transIds):
     """Combined query to a list of EnsemblTranscript for a set of transcript ids"""
     return _buildTrans(conn, list(ensemblTransRecByTransQuery(conn, transIds)))
@@ -287,3 +345,45 @@ def ensemblTransQuery(conn, transIds):
 def ensemblGeneQuery(conn, geneIds):
     """Combined query to a list of EnsemblTranscript for a set of gene ids"""
     return _buildTrans(conn, list(ensemblTransRecByGeneQuery(conn, geneIds)))
+
+
+def ensemblGeneTransQuery(conn, geneIds=(), transIds=()):
+    """Combined query to a list of EnsemblTranscript for sets of gene and
+    transcript ids.  The transcripts, exons, and attributes are each queried
+    for all of the ids, in chunks of IN clauses, and joined in memory.  A
+    transcript is only returned once if specified by both gene and transcript ids."""
+    transRecs = {}
+    for transRec in ensemblTransRecByGeneQuery(conn, geneIds):
+        transRecs[(transRec.transcriptDbId, transRec.chrom)] = transRec
+    for transRec in ensemblTransRecByTransQuery(conn, transIds):
+        transRecs[(transRec.transcriptDbId, transRec.chrom)] = transRec
+    return _buildTrans(conn, list(transRecs.values()))
+
+
+def ensemblRangeTransQuery(conn, chrom, start=None, end=None):
+    """Combined query to a list of EnsemblTranscript for transcripts overlapping a
+    range, or all transcripts on chrom if start and end are None"""
+    return _buildTrans(conn, list(ensemblTransRecByRangeQuery(conn, chrom, start, end)))
+
+
+class EnsemblDbQuery(object):
+    """Query for Ensembl records from an Ensembl MySQL database.  This has the
+    same interface as EnsemblSnapshot, which queries a local SQLite snapshot."""
+    def __init__(self, conn):
+        self.conn = conn
+
+    def geneIdRecs(self, coords=None):
+        """Get EnsemblGeneIdRec records, optionally limiting by location"""
+        return list(ensemblGeneIdRecQuery(self.conn, coords))
+
+    def geneTranscripts(self, geneIds=(), transIds=()):
+        """get a list of EnsemblTranscript for sets of gene and transcript ids"""
+        return ensemblGeneTransQuery(self.conn, geneIds, transIds)
+
+    def rangeTranscripts(self, chrom, start=None, end=None):
+        """get a list of EnsemblTranscript overlapping a range or on a chrom"""
+        return ensemblRangeTransQuery(self.conn, chrom, start, end)
+
+    def parCoords(self):
+        """get PAR regions as Coords objects"""
+        return list(ensemblParCoordsRecQuery(self.conn))
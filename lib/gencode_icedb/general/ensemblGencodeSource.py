@@ -3,26 +3,67 @@ Read GENCODE or other Ensembl gene build annotations from an Ensembl
 database.
 """
 from pycbio.hgdata import hgDb
+from pycbio.db import sqliteOps
+from pycbio.hgdata.rangeFinder import RangeFinder
 from gencode_icedb.general.dataOps import ensureList, isChrYPar, ensemblIdSplit
 from gencode_icedb.general.geneAnnot import geneAnnotGroup
 from gencode_icedb.general.ensemblDbAnnotFeatures import EnsemblDbAnnotationFactory
-from gencode_icedb.general.ensemblDbQuery import ensemblGeneIdRecQuery, ensemblTransQuery, ensemblGeneQuery
+from gencode_icedb.general.ensemblDbQuery import EnsemblDbQuery
+from gencode_icedb.general.ensemblSnapshot import EnsemblSnapshot, isEnsemblSnapshot, ensemblSnapshotFile
+
+
+class _RangeCache(object):
+    """Transcripts loaded for a window of a chromosome, indexed by range.  An
+    end of None indicates the whole chromosome was loaded."""
+    def __init__(self, chrom, start, end, transAnnots):
+        self.chrom = chrom
+        self.start = start
+        self.end = end
+        self.index = RangeFinder()
+        for transAnnot in transAnnots:
+            self.index.add(transAnnot.chrom.name, transAnnot.chrom.start, transAnnot.chrom.end,
+                           transAnnot, transAnnot.rna.strand)
+
+    def contains(self, chrom, start, end):
+        return (chrom == self.chrom) and ((self.end is None) or ((self.start <= start) and (end <= self.end)))
+
+    def overlapping(self, chrom, start, end, strand=None):
+        return self.index.overlapping(chrom, start, end, strand)
 
 
 class EnsemblGencodeReader(object):
     """Object for accessing a GENCODE and other Ensembl annotations from the Ensembl MySql data base.
+
+    Range queries load the transcripts in a window of at least rangeWindowSize
+    around the requested range into an in-memory index, so that following
+    queries that fall within the window are not sent to the database.  If
+    prefetchChroms is True, the window is the whole chromosome, which is
+    efficient when most of a chromosome is being queried in order.
+
+    The ensemblDb maybe either a MySQL database or a local SQLite snapshot
+    created by ensemblGencodeDbLoad, specified as sqlite:file.
     """
     def __init__(self, ensemblDb, genomeReader=None, filterChrYPar=True,
-                 transcriptTypes=None):
-        # FIXME: need to remove UCSC assumption here
-        self.conn = hgDb.connect(ensemblDb, useAutoSqlConv=False)
+                 transcriptTypes=None, prefetchChroms=False, rangeWindowSize=1000000):
+        if isEnsemblSnapshot(ensemblDb):
+            self.conn = sqliteOps.connect(ensemblSnapshotFile(ensemblDb), readonly=True)
+            self.dbQuery = EnsemblSnapshot(self.conn)
+        else:
+            # FIXME: need to remove UCSC assumption here
+            self.conn = hgDb.connect(ensemblDb, useAutoSqlConv=False)
+            self.dbQuery = EnsemblDbQuery(self.conn)
         self.filterChrYPar = filterChrYPar
         self.transcriptTypes = frozenset(transcriptTypes) if transcriptTypes is not None else None
         self.annotFactory = EnsemblDbAnnotationFactory(genomeReader)
+        self.prefetchChroms = prefetchChroms
+        self.rangeWindowSize = rangeWindowSize
+        self.rangeCache = None
 
     def close(self):
         self.conn.close()
         self.conn = None
+        self.dbQuery = None
+        self.rangeCache = None
 
     def _makeTransAnnot(self, ensTrans):
         "will return None if chrY PAR trans and these are being filtered"
@@ -35,44 +76,46 @@ class EnsemblGencodeReader(object):
             return transAnnot
 
     def getGeneIds(self):
-        return sorted(set([rec.geneId for rec in ensemblGeneIdRecQuery(self.coords)]))
+        return sorted(set([rec.geneId for rec in self.dbQuery.geneIdRecs()]))
 
-    def _getByTranscriptId(self, transId):
-        """Get annotations as TranscriptFeatures by transcript id.  For
-        PAR regions, multiple transcript can be returned.
-        """
-        ensTranses = ensemblTransQuery(self.conn, transId)
-        if len(ensTranses) == 0:
-            raise Exception("no transcripts with id {}".format(transId))
-        return [self._makeTransAnnot(ensTrans) for ensTrans in ensTranses]
+    @staticmethod
+    def _checkFound(ensTranses, geneIds, transIds):
+        foundGeneIds = frozenset([ensTrans.transcript.geneId for ensTrans in ensTranses])
+        foundTransIds = frozenset([ensTrans.transcript.transcriptId for ensTrans in ensTranses])
+        missingGeneIds = [geneId for geneId in geneIds if geneId not in foundGeneIds]
+        if len(missingGeneIds) > 0:
+            raise Exception("no genes with id {}".format(", ".join(missingGeneIds)))
+        missingTransIds = [transId for transId in transIds if transId not in foundTransIds]
+        if len(missingTransIds) > 0:
+            raise Exception("no transcripts with id {}".format(", ".join(missingTransIds)))
+
+    def _getByIds(self, geneIds, transIds):
+        """get annotations as TranscriptFeatures for lists of gene and
+        transcript ids, with all ids obtained in a few batched queries.  For
+        PAR regions, multiple transcript can be returned."""
+        ensTranses = self.dbQuery.geneTranscripts(geneIds, transIds)
+        self._checkFound(ensTranses, geneIds, transIds)
+        transAnnots = [self._makeTransAnnot(ensTrans) for ensTrans in ensTranses]
+        return [transAnnot for transAnnot in transAnnots if transAnnot is not None]
 
     def getByTranscriptIds(self, transIds):
         """Get an annotation as a TranscriptFeatures by transcript id or ids.  For PAR regions,
         multiple transcript can be returned.
         """
-        transIds = ensureList(transIds)
-        transAnnots = []
-        for transId in transIds:
-            transAnnots.extend(self._getByTranscriptId(transId))
-        return transAnnots
+        return self._getByIds([], ensureList(transIds))
 
     def getByGeneId(self, geneId):
         "get all transcripts associated with a geneId"
-        ensTranses = ensemblGeneQuery(self.conn, geneId)
-        if len(ensTranses) == 0:
-            raise Exception("no genes with id {}".format(geneId))
-        return [self._makeTransAnnot(ensTrans) for ensTrans in ensTranses]
+        return self._getByIds([geneId], [])
+
+    def getByGeneIds(self, geneIds):
+        "get all transcripts associated with a geneId or list of geneIds"
+        return self._getByIds(ensureList(geneIds), [])
 
     def _getByGencodeIds(self, gencodeIds):
         """get annotations as TranscriptFeatures by gene or transcript id (or ids)"""
-        gencodeIds = ensureList(gencodeIds)
-        geneIds, transIds = ensemblIdSplit(gencodeIds)
-        transAnnots = []
-        for geneId in geneIds:
-            transAnnots.extend(self.getByGeneId(geneId))
-        for transId in transIds:
-            transAnnots.extend(self._getByTranscriptId(transId))
-        return transAnnots
+        geneIds, transIds = ensemblIdSplit(ensureList(gencodeIds))
+        return self._getByIds(geneIds, transIds)
 
     def getGenesByGencodeIds(self, gencodeIds):
         """get annotations as GeneAnnotation object, containing the gene's
@@ -80,6 +123,20 @@ class EnsemblGencodeReader(object):
         ids)"""
         return geneAnnotGroup(self._getByGencodeIds(gencodeIds))
 
+    def _loadRange(self, chrom, start, end):
+        if self.prefetchChroms:
+            start = end = None
+        else:
+            pad = max(self.rangeWindowSize - (end - start), 0) // 2
+            start, end = max(start - pad, 0), end + pad
+        transAnnots = [self._makeTransAnnot(ensTrans)
+                       for ensTrans in self.dbQuery.rangeTranscripts(chrom, start, end)]
+        self.rangeCache = _RangeCache(chrom, start, end,
+                                      [transAnnot for transAnnot in transAnnots if transAnnot is not None])
+
     def getTranscriptsOverlapping(self, chrom, start, end, strand=None):
-        """generator get overlapping annotations as TranscriptFeatures"""
-        raise Exception("EnsemblDbAnnotationFactory.getTranscriptsOverlapping not yet implemented")
+        """get overlapping annotations as TranscriptFeatures"""
+        if (self.rangeCache is None) or not self.rangeCache.contains(chrom, start, end):
+            self._loadRange(chrom, start, end)
+        return sorted(self.rangeCache.overlapping(chrom, start, end, strand),
+                      key=lambda t: (t.chrom.start, t.chrom.end, t.rna.name))
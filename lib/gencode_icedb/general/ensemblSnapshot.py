@@ -0,0 +1,309 @@
+"""
+Local SQLite snapshot of the Ensembl core database records used to build
+GENCODE annotations.  The EnsemblTransRec, EnsemblExonRec, EnsemblTransAttrRec
+records and PAR regions are exported from MySQL with a few streaming queries
+and stored unchanged, so EnsemblSnapshot returns the same EnsemblTranscript
+objects as querying the Ensembl database.
+"""
+from pycbio.hgdata.hgSqlite import HgSqliteTable
+from pycbio.hgdata.coords import Coords
+from gencode_icedb.general.ensemblDbQuery import EnsemblGeneIdRec, EnsemblTransRec, EnsemblExonRec, EnsemblTransAttrRec, ensemblTranscriptJoin
+from gencode_icedb.general.ensemblDbQuery import ensemblAllTransRecQuery, ensemblAllExonRecQuery, ensemblAllTransAttrRecQuery, ensemblParCoordsRecQuery
+
+# IMPORTANT: this does not use peewee because the rest of the annotation
+# databases don't use peewee.
+
+ENSEMBL_TRANS_TBL = "ensembl_trans"
+ENSEMBL_EXON_TBL = "ensembl_exon"
+ENSEMBL_TRANS_ATTR_TBL = "ensembl_trans_attr"
+ENSEMBL_PAR_TBL = "ensembl_par"
+
+# prefix of an Ensembl database specification that selects a snapshot
+ENSEMBL_SNAPSHOT_PREFIX = "sqlite:"
+
+# max number of values in an IN clause, kept under SQLite's variable limit
+_maxSetSelect = 512
+
+
+def _chunks(ids):
+    "split list of ids into chunks for IN queries"
+    for i in range(0, len(ids), _maxSetSelect):
+        yield ids[i:i + _maxSetSelect]
+
+
+def _inClause(column, ids):
+    return "({} IN ({}))".format(column, ",".join(len(ids) * ["?"]))
+
+
+def isEnsemblSnapshot(ensemblDb):
+    "is the Ensembl database specification a snapshot (sqlite:file) rather than a MySQL database?"
+    return ensemblDb.startswith(ENSEMBL_SNAPSHOT_PREFIX)
+
+
+def ensemblSnapshotFile(ensemblDb):
+    "get the file name from a snapshot specification (sqlite:file)"
+    return ensemblDb[len(ENSEMBL_SNAPSHOT_PREFIX):]
+
+
+class EnsemblTransSqliteTable(HgSqliteTable):
+    """
+    Snapshot of EnsemblTransRec records.
+    """
+    _createSql = """CREATE TABLE {table} (
+            geneDbId int not null,
+            geneId text not null,
+            geneType text,
+            geneSource text,
+            geneName text,
+            transcriptDbId int not null,
+            transcriptId text not null,
+            transcriptType text,
+            transcriptSource text,
+            chrom text not null,
+            start int not null,
+            end int not null,
+            strand text not null,
+            chromSize int not null,
+            cdsStartExonDbId int,
+            cdsStartOffset int,
+            cdsEndExonDbId int,
+            cdsEndOffset int);"""
+    _insertSql = """INSERT INTO {table} ({columns}) VALUES ({values});"""
+    _indexSql = """CREATE INDEX {table}_geneId on {table} (geneId);
+                   CREATE INDEX {table}_transcriptId on {table} (transcriptId);
+                   CREATE INDEX {table}_chrom_start on {table} (chrom, start);"""
+    columnNames = EnsemblTransRec._fields
+
+    def __init__(self, conn, table=ENSEMBL_TRANS_TBL, create=False):
+        super(EnsemblTransSqliteTable, self).__init__(conn, table)
+        self.maxSpans = None  # loaded on first range query
+        if create:
+            self.create()
+
+    def create(self):
+        """create table"""
+        self._create(self._createSql)
+
+    def index(self):
+        """create index after loading"""
+        self._index(self._indexSql)
+
+    def loads(self, rows):
+        """load rows, which can be EnsemblTransRec or tuples"""
+        self._inserts(self._insertSql, self.columnNames, rows)
+
+    def _queryRecs(self, where, *args):
+        sql = "SELECT {columns} FROM {table} WHERE " + where + " ORDER BY rowid"
+        return self.queryRows(sql, self.columnNames, lambda cur, row: EnsemblTransRec(*row), *args)
+
+    def getByGeneIds(self, geneIds):
+        "generator of EnsemblTransRec for a list of gene ids"
+        for chunk in _chunks(geneIds):
+            yield from self._queryRecs(_inClause("geneId", chunk), *chunk)
+
+    def getByTranscriptIds(self, transIds):
+        "generator of EnsemblTransRec for a list of transcript ids"
+        for chunk in _chunks(transIds):
+            yield from self._queryRecs(_inClause("transcriptId", chunk), *chunk)
+
+    def _obtainMaxSpans(self):
+        if self.maxSpans is None:
+            sql = "SELECT chrom, max(end - start) FROM {table} GROUP BY chrom"
+            self.maxSpans = dict(self.queryRows(sql, (), lambda cur, row: tuple(row)))
+        return self.maxSpans
+
+    def getRangeOverlap(self, chrom, start=None, end=None):
+        """generator of EnsemblTransRec overlapping a range, or all on chrom if
+        start and end are None.  The maximum transcript span on the chromosome
+        is used to limit the range of the start index that is scanned."""
+        if start is None:
+            yield from self._queryRecs("(chrom = ?)", chrom)
+        else:
+            maxSpan = self._obtainMaxSpans().get(chrom)
+            if maxSpan is not None:
+                yield from self._queryRecs("(chrom = ?) AND (start >= ?) AND (start < ?) AND (end > ?)",
+                                           chrom, start - maxSpan, end, start)
+
+    def getGeneIdRecs(self, coords=None):
+        "generator of EnsemblGeneIdRec, optionally limiting by location"
+        sql = "SELECT DISTINCT geneDbId, geneId FROM {table}"
+        args = ()
+        if coords is not None:
+            if coords.start is None:
+                sql += " WHERE (chrom = ?)"
+                args = (coords.name,)
+            else:
+                sql += " WHERE (chrom = ?) AND (end > ?) AND (start < ?)"
+                args = (coords.name, coords.start, coords.end)
+        return self.queryRows(sql, (), lambda cur, row: EnsemblGeneIdRec(*row), *args)
+
+
+class _TransDbIdSqliteTable(HgSqliteTable):
+    """base for tables of per-transcript records, indexed by transcriptDbId"""
+    _insertSql = """INSERT INTO {table} ({columns}) VALUES ({values});"""
+    _indexSql = """CREATE INDEX {table}_transcriptDbId on {table} (transcriptDbId);"""
+
+    def __init__(self, conn, table, create=False):
+        super(_TransDbIdSqliteTable, self).__init__(conn, table)
+        if create:
+            self.create()
+
+    def create(self):
+        """create table"""
+        self._create(self._createSql)
+
+    def index(self):
+        """create index after loading"""
+        self._index(self._indexSql)
+
+    def loads(self, rows):
+        """load rows, which can be records or tuples"""
+        self._inserts(self._insertSql, self.columnNames, rows)
+
+    def getByTranscriptDbIds(self, transDbIds):
+        "generator of records for a list of transcript database ids"
+        for chunk in _chunks(transDbIds):
+            sql = "SELECT {columns} FROM {table} WHERE " + _inClause("transcriptDbId", chunk)
+            yield from self.queryRows(sql, self.columnNames, lambda cur, row: self.recCls(*row), *chunk)
+
+
+class EnsemblExonSqliteTable(_TransDbIdSqliteTable):
+    """
+    Snapshot of EnsemblExonRec records.
+    """
+    _createSql = """CREATE TABLE {table} (
+            transcriptDbId int not null,
+            exonDbId int not null,
+            start int not null,
+            end int not null,
+            startPhase int not null,
+            endPhase int not null);"""
+    columnNames = EnsemblExonRec._fields
+    recCls = EnsemblExonRec
+
+    def __init__(self, conn, table=ENSEMBL_EXON_TBL, create=False):
+        super(EnsemblExonSqliteTable, self).__init__(conn, table, create)
+
+
+class EnsemblTransAttrSqliteTable(_TransDbIdSqliteTable):
+    """
+    Snapshot of EnsemblTransAttrRec records.
+    """
+    _createSql = """CREATE TABLE {table} (
+            transcriptDbId int not null,
+            code text not null,
+            value text);"""
+    columnNames = EnsemblTransAttrRec._fields
+    recCls = EnsemblTransAttrRec
+
+    def __init__(self, conn, table=ENSEMBL_TRANS_ATTR_TBL, create=False):
+        super(EnsemblTransAttrSqliteTable, self).__init__(conn, table, create)
+
+
+class EnsemblParSqliteTable(HgSqliteTable):
+    """
+    Snapshot of PAR regions.
+    """
+    _createSql = """CREATE TABLE {table} (
+            name text not null,
+            start int not null,
+            end int not null,
+            size int not null);"""
+    _insertSql = """INSERT INTO {table} ({columns}) VALUES ({values});"""
+    columnNames = ("name", "start", "end", "size")
+
+    def __init__(self, conn, table=ENSEMBL_PAR_TBL, create=False):
+        super(EnsemblParSqliteTable, self).__init__(conn, table)
+        if create:
+            self.create()
+
+    def create(self):
+        """create table"""
+        self._create(self._createSql)
+
+    def loads(self, coords):
+        """load Coords objects"""
+        self._inserts(self._insertSql, self.columnNames,
+                      [(c.name, c.start, c.end, c.size) for c in coords])
+
+    def genAll(self):
+        "generator of PAR regions as Coords objects"
+        sql = "SELECT {columns} FROM {table}"
+        return self.queryRows(sql, self.columnNames,
+                              lambda cur, row: Coords(row[0], row[1], row[2], size=row[3]))
+
+
+def _loadBatched(dbTable, recs, batchSize):
+    batch = []
+    for rec in recs:
+        batch.append(rec)
+        if len(batch) >= batchSize:
+            dbTable.loads(batch)
+            batch = []
+    if len(batch) > 0:
+        dbTable.loads(batch)
+
+
+def ensemblSnapshotExport(ensConn, conn, batchSize=10000):
+    """Export records for all transcripts from an Ensembl MySQL database
+    connection to a snapshot in an SQLite database.  Each record type is
+    obtained with a single streaming query and loaded in batches; indexes are
+    created after loading.  Exons and attributes of transcripts that are
+    excluded from the transcript query (LRG) are dropped."""
+    transDbTable = EnsemblTransSqliteTable(conn, create=True)
+    transDbIds = set()
+
+    def transRecs():
+        for transRec in ensemblAllTransRecQuery(ensConn):
+            transDbIds.add(transRec.transcriptDbId)
+            yield transRec
+
+    _loadBatched(transDbTable, transRecs(), batchSize)
+    exonDbTable = EnsemblExonSqliteTable(conn, create=True)
+    _loadBatched(exonDbTable, (r for r in ensemblAllExonRecQuery(ensConn) if r.transcriptDbId in transDbIds),
+                 batchSize)
+    attrDbTable = EnsemblTransAttrSqliteTable(conn, create=True)
+    _loadBatched(attrDbTable, (r for r in ensemblAllTransAttrRecQuery(ensConn) if r.transcriptDbId in transDbIds),
+                 batchSize)
+    parDbTable = EnsemblParSqliteTable(conn, create=True)
+    parDbTable.loads(list(ensemblParCoordsRecQuery(ensConn)))
+    for dbTable in (transDbTable, exonDbTable, attrDbTable):
+        dbTable.index()
+
+
+class EnsemblSnapshot(object):
+    """Query for Ensembl records from a local SQLite snapshot.  This has the
+    same interface as EnsemblDbQuery."""
+    def __init__(self, conn):
+        self.conn = conn
+        self.transDbTable = EnsemblTransSqliteTable(conn)
+        self.exonDbTable = EnsemblExonSqliteTable(conn)
+        self.attrDbTable = EnsemblTransAttrSqliteTable(conn)
+        self.parDbTable = EnsemblParSqliteTable(conn)
+
+    def _buildTrans(self, transRecs):
+        transDbIds = sorted(set([transRec.transcriptDbId for transRec in transRecs]))
+        return ensemblTranscriptJoin(transRecs,
+                                     list(self.exonDbTable.getByTranscriptDbIds(transDbIds)),
+                                     list(self.attrDbTable.getByTranscriptDbIds(transDbIds)))
+
+    def geneIdRecs(self, coords=None):
+        """Get EnsemblGeneIdRec records, optionally limiting by location"""
+        return list(self.transDbTable.getGeneIdRecs(coords))
+
+    def geneTranscripts(self, geneIds=(), transIds=()):
+        """get a list of EnsemblTranscript for sets of gene and transcript ids"""
+        transRecs = {}
+        for transRec in self.transDbTable.getByGeneIds(list(geneIds)):
+            transRecs[(transRec.transcriptDbId, transRec.chrom)] = transRec
+        for transRec in self.transDbTable.getByTranscriptIds(list(transIds)):
+            transRecs[(transRec.transcriptDbId, transRec.chrom)] = transRec
+        return self._buildTrans(list(transRecs.values()))
+
+    def rangeTranscripts(self, chrom, start=None, end=None):
+        """get a list of EnsemblTranscript overlapping a range or on a chrom"""
+        return self._buildTrans(list(self.transDbTable.getRangeOverlap(chrom, start, end)))
+
+    def parCoords(self):
+        """get PAR regions as Coords objects"""
+        return list(self.parDbTable.genAll())
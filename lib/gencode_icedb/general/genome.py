@@ -2,18 +2,28 @@
 Functions around reading and classifying sequence
 """
 import os
+import json
+import struct
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
 from pycbio.hgdata import dnaOps
 from twobitreader import TwoBitFile
 from pysam.libcfaidx import FastaFile
 
 
+# genome file name prefix used to select a genome in shared memory
+SHARED_MEMORY_PREFIX = "shm:"
+
+
 class GenomeReader(object):
     """Base class for genome sequence file readers. Also serves as a factory."""
 
     @classmethod
     def getFromFileName(cls, genomeFile):
-        """get read for *.2bit or *.fa file"""
-        if genomeFile.endswith(".2bit"):
+        """get read for *.2bit or *.fa file, or shm:name for a genome in shared memory"""
+        if genomeFile.startswith(SHARED_MEMORY_PREFIX):
+            return GenomeReaderSharedMemory(genomeFile[len(SHARED_MEMORY_PREFIX):])
+        elif genomeFile.endswith(".2bit"):
             return GenomeReaderTwoBit(genomeFile)
         elif genomeFile.endswith(".fa") or genomeFile.endswith(".fa.gz"):
             return GenomeReaderFasta(genomeFile)
@@ -121,3 +131,128 @@ class GenomeReaderFasta(GenomeReader):
 
     def getChromSize(self, chrom):
         return self.faReader.get_reference_length(chrom)
+
+
+# Shared memory layout: header length (uint64), JSON header of
+# [[chrom, offset, size], ...], followed by the sequences as ASCII bytes.
+_shmHeaderLenStruct = struct.Struct("<Q")
+
+# names of shared memory segments created by this process
+_createdSharedMemory = set()
+
+
+def _sharedMemoryAttach(name):
+    "attach to shared memory without it being unlinked when this process exits"
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # before Python 3.13, attaching registers the segment with the resource
+        # tracker, which unlinks it on exit.  Child processes share the
+        # creator's tracker, so only unregister in independent processes.
+        shm = shared_memory.SharedMemory(name=name)
+        if (multiprocessing.parent_process() is None) and (name not in _createdSharedMemory):
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class GenomeSharedMemory(object):
+    """
+    Genome sequences decoded once into a shared memory segment, so that
+    multiple worker processes can access it with GenomeReaderSharedMemory
+    without each decoding the sequences.  The segment is removed by
+    unlink() or on exit from a with block.
+    """
+    def __init__(self, genomeReader, chroms=None):
+        if chroms is None:
+            chroms = genomeReader.getChroms()
+        chromSizes = [(chrom, genomeReader.getChromSize(chrom)) for chrom in chroms]
+        index = []
+        offset = 0
+        for chrom, size in chromSizes:
+            index.append((chrom, offset, size))
+            offset += size
+        header = json.dumps(index).encode()
+        dataOffset = _shmHeaderLenStruct.size + len(header)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(dataOffset + offset, 1))
+        _createdSharedMemory.add(self.shm.name)
+        _shmHeaderLenStruct.pack_into(self.shm.buf, 0, len(header))
+        self.shm.buf[_shmHeaderLenStruct.size:dataOffset] = header
+        for chrom, chromOffset, size in index:
+            self.shm.buf[dataOffset + chromOffset:dataOffset + chromOffset + size] = genomeReader.get(chrom, 0, size).encode()
+
+    @property
+    def name(self):
+        "name used to attach to shared memory"
+        return self.shm.name
+
+    @property
+    def genomeFile(self):
+        "name used in place of a genome file name to attach to shared memory"
+        return SHARED_MEMORY_PREFIX + self.shm.name
+
+    def getReader(self):
+        "get a reader for this shared memory"
+        return GenomeReaderSharedMemory(self.shm.name)
+
+    def unlink(self):
+        "close and remove the shared memory, attached readers should be closed first"
+        if self.shm is not None:
+            _createdSharedMemory.discard(self.shm.name)
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.unlink()
+
+
+class GenomeReaderSharedMemory(GenomeReader):
+    """
+    Reads sequences from genome sequences in shared memory created by
+    GenomeSharedMemory.  Sequences are sliced directly from the shared
+    buffer.
+    """
+    def __init__(self, shmName):
+        self.shmName = shmName
+        self.shm = _sharedMemoryAttach(shmName)
+        headerLen = _shmHeaderLenStruct.unpack_from(self.shm.buf, 0)[0]
+        self.dataOffset = _shmHeaderLenStruct.size + headerLen
+        header = bytes(self.shm.buf[_shmHeaderLenStruct.size:self.dataOffset])
+        self.chromIndex = {chrom: (self.dataOffset + offset, size) for chrom, offset, size in json.loads(header)}
+
+    def close(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm = None
+
+    def getOptionArgs(self):
+        "create a vector of options and values for passing to another program"
+        return ["--genomeSeqs={}{}".format(SHARED_MEMORY_PREFIX, self.shmName)]
+
+    def _getChromEntry(self, chrom):
+        entry = self.chromIndex.get(chrom)
+        if entry is None:
+            raise KeyError("chromosome not in shared memory genome: {}".format(chrom))
+        return entry
+
+    def get(self, chrom, start, end, strand=None):
+        offset, size = self._getChromEntry(chrom)
+        if strand == '-':
+            start, end = dnaOps.reverseCoords(start, end, size)
+        start, end = max(start, 0), min(end, size)
+        seq = str(self.shm.buf[offset + start:offset + end], "ascii")
+        if strand == '-':
+            seq = dnaOps.reverseComplement(seq)
+        return seq
+
+    def haveChrom(self, chrom):
+        return chrom in self.chromIndex
+
+    def getChroms(self):
+        return sorted(self.chromIndex.keys())
+
+    def getChromSize(self, chrom):
+        return self._getChromEntry(chrom)[1]
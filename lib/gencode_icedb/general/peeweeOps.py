@@ -4,14 +4,53 @@ Functions to support common peewee operations.
 import os
 import re
 import apsw
+import sqlite3
 import configparser
 import urllib.parse as urlparse
+import urllib.request
 from collections import namedtuple
 from playhouse.apsw_ext import APSWDatabase
+from playhouse.pool import PooledMySQLDatabase
+from playhouse.shortcuts import ReconnectMixin
 from peewee import SqliteDatabase, MySQLDatabase, DatabaseError, CharField
 from pycbio.sys.symEnum import SymEnum
 from pycbio.db import sqliteOps, mysqlOps
 
+# Read-only performance profile for read-heavy access to databases that are not
+# modified while being used, such as by cluster jobs.  Memory map the database,
+# use a large page cache, keep temporary tables in memory, and reject writes.
+# The statement cache size is the number of prepared statements kept for reuse
+# by the repeated queries; it can only be set when the connection is opened.
+sqliteReadOnlyProfilePragmas = (("mmap_size", 256 * 1024 * 1024),
+                                ("cache_size", -64 * 1024),
+                                ("temp_store", "MEMORY"),
+                                ("query_only", 1))
+sqliteReadOnlyStatementCacheSize = 512
+
+
+def sqliteSetReadOnlyProfile(conn):
+    """set read-only profile pragmas on a sqlite3 connection, such as returned
+    by sqliteOps.connect().  This does not set the statement cache size, use
+    sqliteReadOnlyProfileConnect() to get the complete profile."""
+    cur = conn.cursor()
+    for name, value in sqliteReadOnlyProfilePragmas:
+        cur.execute("PRAGMA {}={};".format(name, value))
+    cur.close()
+
+
+def sqliteReadOnlyProfileConnect(sqliteDb):
+    """open a read-only sqlite3 connection with the read-only performance
+    profile, including the statement cache size.  Rows are returned as
+    sqlite3.Row, as with sqliteOps.connect()."""
+    if not os.path.exists(sqliteDb):
+        raise Exception("sqlite database does not exist: {}".format(sqliteDb))
+    uri = "file:{}?mode=ro".format(urllib.request.pathname2url(os.path.abspath(sqliteDb)))
+    conn = sqlite3.connect(uri, uri=True, cached_statements=sqliteReadOnlyStatementCacheSize)
+    conn.row_factory = sqlite3.Row
+    sqliteSetReadOnlyProfile(conn)
+    return conn
+
+
 # URL code inspired by https://github.com/kennethreitz/dj-database-url
 urlparse.uses_netloc.append('mysql')
 urlparse.uses_netloc.append('sqlite')
@@ -23,18 +62,51 @@ class DbType(SymEnum):
     sqlite = 2
 
 
+# default number of rows in each insert for peeweeBulkInsert on MySQL; for SQLite
+# it is limited by the maximum number of variables in a statement.
+mysqlBulkBatchSize = 1000
+sqliteMaxVariables = 999
+
+# SQL run on each new MySQL connection
+mysqlSessionInitSql = "SET default_storage_engine=InnoDB"
+
+
+def _strToBool(s):
+    if s.lower() in ("1", "true", "yes", "on"):
+        return True
+    elif s.lower() in ("0", "false", "no", "off"):
+        return False
+    else:
+        raise ValueError("invalid boolean value in database URL: '{}'".format(s))
+
+
 class DbUrl(namedtuple("DbUrl",
-                       ("url", "scheme", "netloc", "user", "passspec", "host", "port", "database"))):
+                       ("url", "scheme", "netloc", "user", "passspec", "host", "port", "database", "params"),
+                       defaults=(None,))):
     """Parsed JDBC-like URL use to specify the database, host, and user, etc.
+    Query parameters are parsed into the params dict, or None if there are
+    no parameters.  These are used to configure the connection:
+      - pool=true - use a pool of MySQL connections
+      - maxConnections=n - maximum size of the pool
+      - staleTimeout=secs - pooled connections older than this are closed
+      - reconnect=true - reconnect to MySQL if the connection was closed by the server
+      - batchSize=n - number of rows in each insert done by peeweeBulkInsert
     """
     __slots__ = ()
 
+    def getParam(self, name, cnv=str, default=None):
+        "get a parameter converted with cnv, or default if not specified"
+        if (self.params is None) or (name not in self.params):
+            return default
+        return cnv(self.params[name])
+
     @classmethod
     def parse(cls, url):
         def emptyIsNone(s):
             return None if s in ('', None) else urlparse.unquote(s)
 
         p = urlparse.urlparse(url)
+        params = dict(urlparse.parse_qsl(p.query)) if p.query != '' else None
         if p.netloc == '':
             scheme = p.scheme if p.scheme != '' else 'file'
             return DbUrl(url=url,
@@ -44,7 +116,8 @@ class DbUrl(namedtuple("DbUrl",
                          passspec=None,
                          host=None,
                          port=None,
-                         database=emptyIsNone(p.path))
+                         database=emptyIsNone(p.path),
+                         params=params)
         else:
             # parse netloc
             m = re.match("^(((?P<user>[^:@]+)?" "(:(?P<passspec>[^@]+))?" ")@)?"
@@ -60,13 +133,16 @@ class DbUrl(namedtuple("DbUrl",
                          passspec=emptyIsNone(m.group("passspec")),
                          host=emptyIsNone(m.group("host")),
                          port=emptyIsNone(m.group("port")),
-                         database=emptyIsNone(p.path[1:]))
+                         database=emptyIsNone(p.path[1:]),
+                         params=params)
 
 
-def _sqliteConnect(dburl, bindModelFunc, create=False, readonly=True, timeout=None, synchronous=None):
+def _sqliteConnect(dburl, bindModelFunc, create=False, readonly=True, timeout=None, synchronous=None,
+                   readOnlyProfile=False):
     """connect to sqlite3 database and bind to model.  If dburl has no database name,
     or the name is :memory:, an in memory database is created.
-    bindModelFunc is called to bind connection to the peewee models."""
+    bindModelFunc is called to bind connection to the peewee models.
+    If readOnlyProfile is True, the read-only performance profile is used."""
     if dburl.netloc is not None:
         raise Exception("Can't specify network location in sqlite database URL, found '{}': {}", dburl.netloc, dburl.url)
     if create:
@@ -83,7 +159,13 @@ def _sqliteConnect(dburl, bindModelFunc, create=False, readonly=True, timeout=No
     kwargs = {"flags": flags}
     if timeout is not None:
         kwargs["timeout"] = timeout
+    if readOnlyProfile:
+        if not readonly:
+            raise Exception("readOnlyProfile requires a readonly database connection: {}".format(dbFile))
+        kwargs["pragmas"] = sqliteReadOnlyProfilePragmas
+        kwargs["statementcachesize"] = sqliteReadOnlyStatementCacheSize
     conn = APSWDatabase(dbFile, **kwargs)
+    conn.bulkBatchSize = dburl.getParam("batchSize", int, None)
     bindModelFunc(conn)
     if synchronous is not None:
         sqliteOps.setSynchronous(conn, synchronous)
@@ -104,13 +186,42 @@ def _loadMyCnf(dburl):
         mycnf, section = dburl.passspec.rsplit(':', 1)
     else:
         mycnf, section = ("~/.my.cnf", dburl.passspec)
-    cnf = configparser.ConfigParser().read(os.path.expanduser(mycnf))
-    if cnf is None:
-        return {}
-    sec = cnf.get(section)
-    if sec is None:
+    cnf = configparser.ConfigParser()
+    cnf.read(os.path.expanduser(mycnf))
+    if not cnf.has_section(section):
         return {}
-    return sec
+    return dict(cnf[section])
+
+
+class ReconnectMySQLDatabase(ReconnectMixin, MySQLDatabase):
+    """MySQL database that reconnects when the server has closed the
+    connection, such as after wait_timeout, outside of a transaction"""
+    pass
+
+
+class ReconnectPooledMySQLDatabase(ReconnectMixin, PooledMySQLDatabase):
+    """pooled MySQL database that reconnects when the server has closed the
+    connection"""
+    pass
+
+
+def _mysqlDatabase(dburl, kwargs):
+    """create a MySQLDatabase object, which is not yet connected, pooled and/or
+    reconnecting as specified in the URL parameters.  The session setup is
+    passed as a connect argument, so it is done on every connection opened by
+    a pool or on reconnect."""
+    kwargs = dict(kwargs, init_command=mysqlSessionInitSql)
+    pool = dburl.getParam("pool", _strToBool, False)
+    reconnect = dburl.getParam("reconnect", _strToBool, False)
+    if pool:
+        dbCls = ReconnectPooledMySQLDatabase if reconnect else PooledMySQLDatabase
+        kwargs = dict(kwargs,
+                      max_connections=dburl.getParam("maxConnections", int, 8),
+                      stale_timeout=dburl.getParam("staleTimeout", int, 300))
+    else:
+        dbCls = ReconnectMySQLDatabase if reconnect else MySQLDatabase
+    database = kwargs.pop("database", None)
+    return dbCls(database, **kwargs)
 
 
 def _mysqlConnect(dburl, bindModelFunc):
@@ -119,7 +230,7 @@ def _mysqlConnect(dburl, bindModelFunc):
     def addparam(name, kwargs, dburl, mycnf, argname=None):
         """add a parameter to kwargs if defined in dburl or mycnf.  argname allows for different name than
         in input. Arguments not found are not added to kwargs, as some can't be None."""
-        v = dburl.get(name)
+        v = getattr(dburl, name, None)
         if v is None:
             v = mycnf.get(name)
         if v is not None:
@@ -132,20 +243,25 @@ def _mysqlConnect(dburl, bindModelFunc):
     addparam("user", kwargs, dburl, mycnf)
     addparam("password", kwargs, dburl, mycnf, "passwd")
     addparam("database", kwargs, dburl, mycnf)
+    if "port" in kwargs:
+        kwargs["port"] = int(kwargs["port"])
     mysqlOps.mySqlSetErrorOnWarn()
-    conn = MySQLDatabase(dburl, **kwargs)
-    conn.execute_sql("SET default_storage_engine=InnoDb;")
+    conn = _mysqlDatabase(dburl, kwargs)
+    conn.bulkBatchSize = dburl.getParam("batchSize", int, None)
     bindModelFunc(conn)
     return conn
 
 
-def peeweeConnect(url, bindModelFunc, create=False, readonly=True, timeout=None, synchronous=None):
+def peeweeConnect(url, bindModelFunc, create=False, readonly=True, timeout=None, synchronous=None,
+                  readOnlyProfile=False):
     """connect to database using a bind to model. URL is described in
     configuration.md. The bindModelFunc is called to bind connection to
-    peeweemodel """
+    peeweemodel.  If readOnlyProfile is True, sqlite databases are opened
+    with the read-only performance profile, which is ignored for MySQL."""
     dburl = DbUrl.parse(url)
     if dburl.scheme in ("sqlite", "file"):
-        return _sqliteConnect(dburl, bindModelFunc, create=create, readonly=readonly, timeout=readonly, synchronous=synchronous)
+        return _sqliteConnect(dburl, bindModelFunc, create=create, readonly=readonly, timeout=timeout, synchronous=synchronous,
+                              readOnlyProfile=readOnlyProfile)
     elif dburl.scheme == "mysql":
         return _mysqlConnect(dburl, bindModelFunc)
     else:
@@ -206,6 +322,29 @@ class PeeweeModelMixins(object):
         return list(cls._meta.fields.values())
 
 
+def peeweeBulkBatchSize(conn, modelCls):
+    """Number of rows to insert with one statement.  This is the batchSize
+    specified in the database URL, otherwise the default for MySQL, or for
+    SQLite, the most rows that don't exceed the maximum number of variables."""
+    batchSize = getattr(conn, "bulkBatchSize", None)
+    if batchSize is not None:
+        return batchSize
+    elif peeweeDbType(conn) == DbType.sqlite:
+        return max(sqliteMaxVariables // len(modelCls._meta.fields), 1)
+    else:
+        return mysqlBulkBatchSize
+
+
+def peeweeBulkInsert(conn, modelCls, recs, batchSize=None):
+    """Insert a list of records (as dicts) in batches, all in one
+    transaction.  If batchSize is None, it is obtained from peeweeBulkBatchSize."""
+    if batchSize is None:
+        batchSize = peeweeBulkBatchSize(conn, modelCls)
+    with conn.atomic():
+        for idx in range(0, len(recs), batchSize):
+            modelCls.insert_many(recs[idx:idx + batchSize]).execute()
+
+
 def peeweeBulkLoadSetup(conn):
     conn.cache_size = -32 * 1024 * 1024
     conn.synchronous = 0
@@ -214,3 +353,13 @@ def peeweeBulkLoadSetup(conn):
     conn.count_changes = 0
     conn.temp_store = "MEMORY"
     conn.auto_vacuum = 0
+
+
+def peeweeWalLoadSetup(conn):
+    """Setup for loading in write-ahead-log mode, which allows readers while
+    loading and multiple processes to load, one transaction at a time.  Open
+    the connection with a timeout to wait on other writers."""
+    conn.journal_mode = "WAL"
+    conn.synchronous = 1  # NORMAL is safe in WAL mode
+    conn.cache_size = -32 * 1024 * 1024
+    conn.temp_store = "MEMORY"
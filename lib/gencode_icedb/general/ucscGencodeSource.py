@@ -9,6 +9,7 @@ from pycbio.hgdata.gencodeSqlite import GencodeAttrsSqliteTable, GencodeTagSqlit
 from gencode_icedb.general.dataOps import ensureList, isChrYPar, ensemblIdSplit
 from gencode_icedb.general.genePredAnnotFeatures import GenePredAnnotationFactory
 from gencode_icedb.general.geneAnnot import geneAnnotGroup
+from gencode_icedb.general.peeweeOps import sqliteReadOnlyProfileConnect
 
 
 # tables in sqlite databases
@@ -21,11 +22,16 @@ GENCODE_GENE_TABLE = "gencode_gene"
 
 
 class UcscGencodeReader(object):
-    """Object for accessing a GENCODE sqlite database with UCSC tables.
+    """Object for accessing a GENCODE sqlite database with UCSC tables.  If
+    readOnlyProfile is True, the database is opened with the read-only
+    performance profile, which is good for jobs doing many queries.
     """
     def __init__(self, gencodeDbFile, genomeReader=None, filterChrYPar=True,
-                 transcriptTypes=None):
-        self.conn = sqliteOps.connect(gencodeDbFile)
+                 transcriptTypes=None, readOnlyProfile=False):
+        if readOnlyProfile:
+            self.conn = sqliteReadOnlyProfileConnect(gencodeDbFile)
+        else:
+            self.conn = sqliteOps.connect(gencodeDbFile)
         self.filterChrYPar = filterChrYPar
         self.transcriptTypes = frozenset(transcriptTypes) if transcriptTypes is not None else None
         self.genePredDbTable = GenePredSqliteTable(self.conn, GENCODE_ANN_TABLE)
@@ -15,9 +15,10 @@ def setDatabaseConn(dbconn):
     _database_proxy.initialize(dbconn)
 
 
-def rslConnect(dburl, create=False, readonly=True, timeout=None, synchronous=None):
+def rslConnect(dburl, create=False, readonly=True, timeout=None, synchronous=None, readOnlyProfile=False):
     "connect to sqlite3 database and bind to model"
-    return peeweeConnect(dburl, setDatabaseConn, create=create, readonly=readonly, timeout=timeout, synchronous=synchronous)
+    return peeweeConnect(dburl, setDatabaseConn, create=create, readonly=readonly, timeout=timeout, synchronous=synchronous,
+                         readOnlyProfile=readOnlyProfile)
 
 
 def rslClose(conn):
@@ -1,12 +1,16 @@
 """
 Read evidence alignments from tabix files.
 """
+import os
+import heapq
 import pysam
 from pycbio.sys.symEnum import SymEnum, auto
 from pycbio.sys.objDict import ObjDict
 from pycbio.hgdata.psl import Psl
+from pycbio.db import sqliteOps
 from gencode_icedb.general.evidFeatures import EvidencePslFactory, EvidenceSamFactory
 from gencode_icedb.general.transFeatures import ExonFeature
+from gencode_icedb.tsl.evidenceFeaturesSqlite import EVIDENCE_FEATURES_EXT, EvidenceFeaturesSqliteTable
 import pipettor
 
 
@@ -28,14 +32,36 @@ def evidenceAlignsIndexPsl(pslFile):
     pipettor.run(["tabix", "--force", "--sequence=14", "--begin=16", "--end=17", "--zero-based", pslFile])
 
 
+def evidencePslStrandFiles(pslFile):
+    """Get the names of PSL files for strand-partitioned layout of pslFile,
+    as a dict of transcription strand to file name.  For a pslFile of
+    X.psl.gz, these are X.pos.psl.gz and X.neg.psl.gz"""
+    base = pslFile[:-len(".psl.gz")]
+    return {'+': base + ".pos.psl.gz",
+            '-': base + ".neg.psl.gz"}
+
+
+def _isStrandPartitioned(pslFile):
+    return ((not os.path.exists(pslFile))
+            and all([os.path.exists(f) for f in evidencePslStrandFiles(pslFile).values()]))
+
+
 class EvidenceAlignsReader(object):
     """Object for accessing overlapping alignment evidence data from a data source.  Either PSL file
-    that is bgzip compressed and tabix indexed or a BAM file.
+    that is bgzip compressed and tabix indexed or a BAM file.  Derived classes
+    implement genOverlapping(), close(), and countOverlapping(chrom, start, end),
+    which counts alignments overlapping a range, without converting them to
+    features or applying nameSubset, to estimate the amount of work for a range.
     """
     def __init__(self, evidSetUuid):
         self.evidSetUuid = evidSetUuid
         self.nameSubset = None  # used for testing and debugging.
 
+    @property
+    def evidSetUuids(self):
+        "tuple of evidence set UUIDs returned by this reader"
+        return (self.evidSetUuid,)
+
     def setNameSubset(self, nameSubset):
         """Set file on query names.  Can be a string, list, or set, or None to
         clear.  This is use for testing and debugging"""
@@ -97,6 +123,22 @@ class _PslEvidenceAlignsReader(EvidenceAlignsReader):
         if coords.name in self.contigs:
             yield from self._genOverlapping(coords, self._getSelectStrands(transcriptionStrand), minExons)
 
+    def countOverlapping(self, chrom, start, end):
+        if chrom not in self.contigs:
+            return 0
+        return sum(1 for line in self.tabix.fetch(chrom, start, end))
+
+    def genAll(self, minExons=0):
+        """Generator of all alignments as TranscriptFeatures, possibly filtered
+        by nameSubset."""
+        for contig in sorted(self.contigs):
+            for line in self.tabix.fetch(contig):
+                psl = Psl.fromRow(line.split('\t'))
+                if self._usePsl(psl, self._allStrands):
+                    trans = self._makeTrans(psl)
+                    if len(trans.getFeaturesOfType(ExonFeature)) >= minExons:
+                        yield trans
+
 
 class _BamEvidenceAlignsReader(EvidenceAlignsReader):
     "Reader implementation for a BAM file"
@@ -134,12 +176,165 @@ class _BamEvidenceAlignsReader(EvidenceAlignsReader):
         if coords.name in self.contigs:
             yield from self._genOverlapping(coords, transcriptionStrand, minExons)
 
+    def countOverlapping(self, chrom, start, end):
+        if chrom not in self.contigs:
+            return 0
+        return self.bamfh.count(chrom, start, end)
+
+    def genAll(self, minExons=0):
+        """Generator of all alignments as TranscriptFeatures, possibly filtered
+        by nameSubset.  Unmapped reads are skipped."""
+        for alnseg in self.bamfh.fetch():
+            if (not alnseg.is_unmapped) and self._useAln(alnseg, None):
+                trans = self._makeTrans(alnseg)
+                if len(trans.getFeaturesOfType(ExonFeature)) >= minExons:
+                    yield trans
+
+
+class _FeaturesEvidenceAlignsReader(EvidenceAlignsReader):
+    """Reader implementation for evidence that has been pre-converted to
+    features and stored in an SQLite database (see evidenceFeaturesSqlite)"""
+    def __init__(self, evidSetUuid, evidFeaturesDb):
+        super(_FeaturesEvidenceAlignsReader, self).__init__(evidSetUuid)
+        self.conn = sqliteOps.connect(evidFeaturesDb, readonly=True)
+        self.featuresDbTable = EvidenceFeaturesSqliteTable(self.conn)
+        self.contigs = self.featuresDbTable.getChroms()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def _useTrans(self, trans):
+        return (self.nameSubset is None) or (trans.rna.name in self.nameSubset)
+
+    def genOverlapping(self, coords, transcriptionStrand=None, minExons=0):
+        """Generator of overlapping alignments as TranscriptFeatures, possibly filtered
+        by nameSubset.
+        """
+        if coords.name in self.contigs:
+            for trans in self.featuresDbTable.getRangeOverlap(coords.name, coords.start, coords.end,
+                                                              transcriptionStrand=transcriptionStrand, minExons=minExons):
+                if self._useTrans(trans):
+                    trans.attrs.evidSetUuid = self.evidSetUuid
+                    yield trans
+
+    def countOverlapping(self, chrom, start, end):
+        return self.featuresDbTable.countRangeOverlap(chrom, start, end)
+
+
+class MultiEvidenceAlignsReader(EvidenceAlignsReader):
+    """Reader that combines several evidence sets, so they can be evaluated in
+    one pass over the annotations.  All sources are queried for the same
+    range, and each alignment is tagged in its attrs with the evidSetUuid of
+    the source it came from."""
+    def __init__(self, evidenceReaders):
+        super(MultiEvidenceAlignsReader, self).__init__(None)
+        self.evidenceReaders = tuple(evidenceReaders)
+        if len(set(self.evidSetUuids)) != len(self.evidenceReaders):
+            raise Exception("duplicate evidence set UUIDs in: {}".format(", ".join([str(u) for u in self.evidSetUuids])))
+
+    @property
+    def evidSetUuids(self):
+        return tuple([rdr.evidSetUuid for rdr in self.evidenceReaders])
+
+    def close(self):
+        for rdr in self.evidenceReaders:
+            rdr.close()
+
+    def setNameSubset(self, nameSubset):
+        for rdr in self.evidenceReaders:
+            rdr.setNameSubset(nameSubset)
+
+    def genOverlapping(self, coords, transcriptionStrand=None, minExons=0):
+        """Generator of overlapping alignments as TranscriptFeatures from all
+        sources, in the order the readers were specified.
+        """
+        for rdr in self.evidenceReaders:
+            yield from rdr.genOverlapping(coords, transcriptionStrand=transcriptionStrand, minExons=minExons)
+
+    def countOverlapping(self, chrom, start, end):
+        return sum([rdr.countOverlapping(chrom, start, end) for rdr in self.evidenceReaders])
+
+
+def evidencePslTranscriptionStrand(pslStrand):
+    "get the transcription strand implied by a PSL strand"
+    return '+' if pslStrand in _PslEvidenceAlignsReader._posStrands else '-'
+
+
+class _StrandedPslEvidenceAlignsReader(EvidenceAlignsReader):
+    """Reader implementation for PSL tabix files that are partitioned by
+    transcription strand, so strand-specific queries only read the blocks
+    for that strand."""
+    def __init__(self, evidSetUuid, strandPslFiles, genomeReader=None, genbankProblems=None):
+        super(_StrandedPslEvidenceAlignsReader, self).__init__(evidSetUuid)
+        self.strandReaders = {strand: _PslEvidenceAlignsReader(evidSetUuid, pslFile, genomeReader, genbankProblems)
+                              for strand, pslFile in strandPslFiles.items()}
+
+    def close(self):
+        for rdr in self.strandReaders.values():
+            rdr.close()
+
+    def setNameSubset(self, nameSubset):
+        super(_StrandedPslEvidenceAlignsReader, self).setNameSubset(nameSubset)
+        for rdr in self.strandReaders.values():
+            rdr.setNameSubset(nameSubset)
+
+    def genOverlapping(self, coords, transcriptionStrand=None, minExons=0):
+        """Generator of overlapping alignments as TranscriptFeatures, possibly filtered
+        by nameSubset.  If transcriptionStrand is not specified, alignments from both
+        strands are merged by start position.
+        """
+        if transcriptionStrand is not None:
+            yield from self.strandReaders[transcriptionStrand].genOverlapping(coords, transcriptionStrand, minExons)
+        else:
+            yield from heapq.merge(*[self.strandReaders[strand].genOverlapping(coords, None, minExons)
+                                     for strand in sorted(self.strandReaders.keys())],
+                                   key=lambda trans: trans.chrom.start)
+
+    def countOverlapping(self, chrom, start, end):
+        return sum([rdr.countOverlapping(chrom, start, end) for rdr in self.strandReaders.values()])
+
+    def genAll(self, minExons=0):
+        """Generator of all alignments as TranscriptFeatures, possibly filtered
+        by nameSubset."""
+        yield from heapq.merge(*[self.strandReaders[strand].genAll(minExons)
+                                 for strand in sorted(self.strandReaders.keys())],
+                               key=lambda trans: (trans.chrom.name, trans.chrom.start))
+
+
+def _indexFiles(dataFile, indexExts):
+    "get existing index files for a data file"
+    return [dataFile + ext for ext in indexExts if os.path.exists(dataFile + ext)]
+
+
+def evidenceAlignsFiles(evidFile):
+    """Get the files read by the reader that evidenceAlignsReaderFactory
+    creates for evidFile, as a tuple of (dataFiles, indexFiles)."""
+    if evidFile.endswith(".psl.gz") and _isStrandPartitioned(evidFile):
+        dataFiles = [evidencePslStrandFiles(evidFile)[strand] for strand in ('+', '-')]
+        return (dataFiles, sum([_indexFiles(f, (".tbi", ".csi")) for f in dataFiles], []))
+    elif evidFile.endswith(".psl.gz"):
+        return ([evidFile], _indexFiles(evidFile, (".tbi", ".csi")))
+    elif evidFile.endswith(".bam"):
+        return ([evidFile], _indexFiles(evidFile, (".bai", ".csi")))
+    else:
+        return ([evidFile], [])
+
 
 def evidenceAlignsReaderFactory(evidSetUuid, evidFile, genomeReader=None, genbankProblems=None):
-    """construct read based on file extension"""
-    if evidFile.endswith(".psl.gz"):
+    """construct read based on file extension.  Pre-converted features
+    databases already contain splice sites and GenBank problem flags, so
+    genomeReader and genbankProblems are not used with them.  If a .psl.gz
+    file doesn't exist, but the strand-partitioned files do, they are used
+    (see evidencePslStrandFiles)."""
+    if evidFile.endswith(".psl.gz") and _isStrandPartitioned(evidFile):
+        return _StrandedPslEvidenceAlignsReader(evidSetUuid, evidencePslStrandFiles(evidFile), genomeReader, genbankProblems)
+    elif evidFile.endswith(".psl.gz"):
         return _PslEvidenceAlignsReader(evidSetUuid, evidFile, genomeReader, genbankProblems)
     elif evidFile.endswith(".bam"):
         return _BamEvidenceAlignsReader(evidSetUuid, evidFile, genomeReader)
+    elif evidFile.endswith(EVIDENCE_FEATURES_EXT):
+        return _FeaturesEvidenceAlignsReader(evidSetUuid, evidFile)
     else:
-        raise Exception("Expected file name ending in .psl.gz or .bam, got {}".format(evidFile))
+        raise Exception("Expected file name ending in .psl.gz, .bam, or {}, got {}".format(EVIDENCE_FEATURES_EXT, evidFile))
@@ -0,0 +1,269 @@
+"""
+Storage of evidence alignments that have been pre-converted to
+TranscriptFeatures.  Converting PSL or BAM records to features (closing gaps,
+finding indels) is done for every gene in every job, so this allows the
+conversion to be done once per evidence set.
+
+The features of each alignment are packed into a binary blob and stored in
+an SQLite table indexed by chromosome location.  Only alignments converted with
+orientChrom=True are supported, so the chromosome strand is always positive.
+"""
+import struct
+from pycbio.hgdata.hgSqlite import HgSqliteTable
+from pycbio.hgdata.coords import Coords
+from pycbio.sys.objDict import ObjDict
+from gencode_icedb.general.transFeatures import ExonFeature, IntronFeature, TranscriptFeatures
+from gencode_icedb.general.transFeatures import AlignedFeature, ChromInsertFeature, RnaInsertFeature
+from gencode_icedb.tsl.supportDefs import GenbankProblemReason
+
+EVIDENCE_FEATURES_TBL = "evidence_features"
+EVIDENCE_FEATURES_CHROM_TBL = "evidence_features_chrom"
+
+# file extension used to select the reader
+EVIDENCE_FEATURES_EXT = ".evfeat.db"
+
+# blob layouts, little-endian:
+#   transcript: rnaStart, rnaEnd, rnaSize, chromStrand, rnaStrand, transcriptionStrand, numFeatures
+#   structure: type, chromStart, chromEnd, rnaStart, rnaEnd, numAlignFeatures, donorSeq, acceptorSeq
+#   alignment: type, chromStart, chromEnd, rnaStart, rnaEnd (-1 if range is None)
+_transStruct = struct.Struct("<iiicccH")
+_structStruct = struct.Struct("<ciiiiH2s2s")
+_alignStruct = struct.Struct("<ciiii")
+
+_EXON = b'E'
+_INTRON = b'I'
+_ALIGNED = b'A'
+_CHROM_INS = b'C'
+_RNA_INS = b'R'
+
+_alignFeatureTypes = {
+    AlignedFeature: _ALIGNED,
+    ChromInsertFeature: _CHROM_INS,
+    RnaInsertFeature: _RNA_INS,
+}
+
+
+def _rangeBounds(coords):
+    return (-1, -1) if coords is None else (coords.start, coords.end)
+
+
+def _seqToBytes(seq):
+    return b"" if seq is None else seq.encode()
+
+
+def _bytesToSeq(buf):
+    buf = buf.rstrip(b'\0')
+    return None if len(buf) == 0 else buf.decode()
+
+
+def _packAlignFeature(feat, parts):
+    parts.append(_alignStruct.pack(_alignFeatureTypes[type(feat)],
+                                   *(_rangeBounds(feat.chrom) + _rangeBounds(feat.rna))))
+
+
+def _packStructFeature(feat, parts):
+    if isinstance(feat, ExonFeature):
+        ftype, donorSeq, acceptorSeq = _EXON, None, None
+    else:
+        ftype, donorSeq, acceptorSeq = _INTRON, feat.donorSeq, feat.acceptorSeq
+    parts.append(_structStruct.pack(ftype, feat.chrom.start, feat.chrom.end, feat.rna.start, feat.rna.end,
+                                    len(feat.alignFeatures), _seqToBytes(donorSeq), _seqToBytes(acceptorSeq)))
+    for alnFeat in feat.alignFeatures:
+        _packAlignFeature(alnFeat, parts)
+
+
+def evidFeaturesPack(trans):
+    """pack the features of an evidence TranscriptFeatures object into bytes"""
+    if trans.chrom.strand != '+':
+        raise Exception("evidence features must be converted with orientChrom: {}".format(trans.rna.name))
+    parts = [_transStruct.pack(trans.rna.start, trans.rna.end, trans.rna.size,
+                               trans.chrom.strand.encode(), trans.rna.strand.encode(),
+                               trans.transcriptionStrand.encode(), len(trans.features))]
+    for feat in trans.features:
+        _packStructFeature(feat, parts)
+    return b"".join(parts)
+
+
+class _FeaturesUnpacker(object):
+    """unpack features from a blob into a TranscriptFeatures object"""
+    def __init__(self, buf, chrom, chromSize, name):
+        self.buf = buf
+        self.off = 0
+        self.chrom = chrom
+        self.chromSize = chromSize
+        self.name = name
+        self.chromStrand = self.rnaStrand = self.rnaSize = None
+
+    def _unpack(self, st):
+        vals = st.unpack_from(self.buf, self.off)
+        self.off += st.size
+        return vals
+
+    def _chromCoords(self, start, end):
+        return Coords(self.chrom, start, end, self.chromStrand, self.chromSize)
+
+    def _rnaCoords(self, start, end):
+        return Coords(self.name, start, end, self.rnaStrand, self.rnaSize)
+
+    def _unpackAlignFeature(self, parent, iParent):
+        ftype, chromStart, chromEnd, rnaStart, rnaEnd = self._unpack(_alignStruct)
+        if ftype == _ALIGNED:
+            return AlignedFeature(parent, iParent, self._chromCoords(chromStart, chromEnd), self._rnaCoords(rnaStart, rnaEnd))
+        elif ftype == _CHROM_INS:
+            return ChromInsertFeature(parent, iParent, self._chromCoords(chromStart, chromEnd))
+        else:
+            return RnaInsertFeature(parent, iParent, self._rnaCoords(rnaStart, rnaEnd))
+
+    def _unpackStructFeature(self, trans, iParent):
+        ftype, chromStart, chromEnd, rnaStart, rnaEnd, numAlign, donorSeq, acceptorSeq = self._unpack(_structStruct)
+        if ftype == _EXON:
+            feat = ExonFeature(trans, iParent, self._chromCoords(chromStart, chromEnd), self._rnaCoords(rnaStart, rnaEnd))
+        else:
+            feat = IntronFeature(trans, iParent, self._chromCoords(chromStart, chromEnd), self._rnaCoords(rnaStart, rnaEnd),
+                                 _bytesToSeq(donorSeq), _bytesToSeq(acceptorSeq))
+        feat.alignFeatures = tuple([self._unpackAlignFeature(feat, i) for i in range(numAlign)])
+        return feat
+
+    def unpack(self, chromStart, chromEnd, attrs):
+        rnaStart, rnaEnd, self.rnaSize, chromStrand, rnaStrand, transcriptionStrand, numFeats = self._unpack(_transStruct)
+        self.chromStrand, self.rnaStrand = chromStrand.decode(), rnaStrand.decode()
+        trans = TranscriptFeatures(self._chromCoords(chromStart, chromEnd), self._rnaCoords(rnaStart, rnaEnd),
+                                   transcriptionStrand=transcriptionStrand.decode(), attrs=attrs)
+        trans.features = tuple([self._unpackStructFeature(trans, i) for i in range(numFeats)])
+        return trans
+
+
+def evidFeaturesUnpack(buf, chrom, chromStart, chromEnd, chromSize, name, attrs=None):
+    """unpack a TranscriptFeatures object from bytes created by evidFeaturesPack"""
+    return _FeaturesUnpacker(buf, chrom, chromSize, name).unpack(chromStart, chromEnd, attrs)
+
+
+class EvidenceFeaturesChromSqliteTable(HgSqliteTable):
+    """
+    Maximum alignment span on each chromosome of an evidence features table.
+    This limits the range scanned with the chromStart index on overlap
+    queries.
+    """
+    _createSql = """CREATE TABLE {table} (
+            chrom text not null,
+            maxSpan int not null);"""
+    _insertSql = """INSERT INTO {table} ({columns}) VALUES ({values});"""
+    _indexSql = """CREATE UNIQUE INDEX {table}_chrom on {table} (chrom);"""
+    columnNames = ("chrom", "maxSpan")
+
+    def __init__(self, conn, table=EVIDENCE_FEATURES_CHROM_TBL, create=False):
+        super(EvidenceFeaturesChromSqliteTable, self).__init__(conn, table)
+        if create:
+            self.create()
+
+    def create(self):
+        """create table"""
+        self._create(self._createSql)
+
+    def index(self):
+        """create index after loading"""
+        self._index(self._indexSql)
+
+    def loads(self, rows):
+        """load rows of (chrom, maxSpan)"""
+        self._inserts(self._insertSql, self.columnNames, rows)
+
+    def getMaxSpans(self):
+        "get dict of chrom to maximum span"
+        sql = "SELECT {columns} FROM {table}"
+        return dict(self.queryRows(sql, self.columnNames, lambda cur, row: tuple(row)))
+
+
+class EvidenceFeaturesSqliteTable(HgSqliteTable):
+    """
+    Storage for pre-converted evidence features.
+    """
+    _createSql = """CREATE TABLE {table} (
+            chrom text not null,
+            chromStart int not null,
+            chromEnd int not null,
+            chromSize int not null,
+            name text not null,
+            transcriptionStrand text not null,
+            exonCnt int not null,
+            genbankProblem text,
+            feats blob not null);"""
+    _insertSql = """INSERT INTO {table} ({columns}) VALUES ({values});"""
+    _indexSql = """CREATE INDEX {table}_chrom_start on {table} (chrom, chromStart);
+                   CREATE INDEX {table}_name on {table} (name);"""
+    columnNames = ("chrom", "chromStart", "chromEnd", "chromSize", "name",
+                   "transcriptionStrand", "exonCnt", "genbankProblem", "feats")
+
+    def __init__(self, conn, table=EVIDENCE_FEATURES_TBL, create=False):
+        super(EvidenceFeaturesSqliteTable, self).__init__(conn, table)
+        self.chromDbTable = EvidenceFeaturesChromSqliteTable(conn, create=create)
+        self.maxSpans = {} if create else None  # loaded on first query
+        if create:
+            self.create()
+
+    def create(self):
+        """create table"""
+        self._create(self._createSql)
+
+    def index(self):
+        """create indexes and save chromosome spans after loading"""
+        self._index(self._indexSql)
+        self.chromDbTable.loads(sorted(self.maxSpans.items()))
+        self.chromDbTable.index()
+
+    @staticmethod
+    def _toRow(trans):
+        genbankProblem = trans.attrs.get("genbankProblem") if trans.attrs is not None else None
+        return (trans.chrom.name, trans.chrom.start, trans.chrom.end, trans.chrom.size, trans.rna.name,
+                trans.transcriptionStrand, len(trans.getFeaturesOfType(ExonFeature)),
+                None if genbankProblem is None else str(genbankProblem),
+                evidFeaturesPack(trans))
+
+    def loads(self, transes):
+        """load evidence TranscriptFeatures objects into table"""
+        rows = []
+        for trans in transes:
+            rows.append(self._toRow(trans))
+            self.maxSpans[trans.chrom.name] = max(len(trans.chrom), self.maxSpans.get(trans.chrom.name, 0))
+        self._inserts(self._insertSql, self.columnNames, rows)
+
+    def _obtainMaxSpans(self):
+        if self.maxSpans is None:
+            self.maxSpans = self.chromDbTable.getMaxSpans()
+        return self.maxSpans
+
+    def getChroms(self):
+        "get chromosomes with evidence"
+        return frozenset(self._obtainMaxSpans().keys())
+
+    @staticmethod
+    def _rowToTrans(row):
+        chrom, chromStart, chromEnd, chromSize, name, transcriptionStrand, exonCnt, genbankProblem, feats = row
+        attrs = ObjDict(genbankProblem=GenbankProblemReason(genbankProblem) if genbankProblem is not None else None)
+        return evidFeaturesUnpack(feats, chrom, chromStart, chromEnd, chromSize, name, attrs)
+
+    def getRangeOverlap(self, chrom, start, end, transcriptionStrand=None, minExons=0):
+        """Generator of TranscriptFeatures overlapping the range, possibly
+        restricted to a transcription strand and a minimum number of exons.
+        Results are in the order loaded within a given start."""
+        maxSpan = self._obtainMaxSpans().get(chrom)
+        if maxSpan is None:
+            return
+        sql = ("SELECT {columns} FROM {table} WHERE (chrom = ?) AND (chromStart >= ?) AND (chromStart < ?) "
+               "AND (chromEnd > ?) AND (exonCnt >= ?)")
+        args = [chrom, start - maxSpan, end, start, minExons]
+        if transcriptionStrand is not None:
+            sql += " AND (transcriptionStrand = ?)"
+            args.append(transcriptionStrand)
+        sql += " ORDER BY chromStart, rowid"
+        yield from self.queryRows(sql, self.columnNames,
+                                  lambda cur, row: self._rowToTrans(row), *args)
+
+    def countRangeOverlap(self, chrom, start, end):
+        """count of alignments overlapping the range"""
+        maxSpan = self._obtainMaxSpans().get(chrom)
+        if maxSpan is None:
+            return 0
+        sql = ("SELECT count(*) FROM {table} WHERE (chrom = ?) AND (chromStart >= ?) AND (chromStart < ?) "
+               "AND (chromEnd > ?)")
+        return next(self.queryRows(sql, (), lambda cur, row: row[0], chrom, start - maxSpan, end, start))
@@ -1,7 +1,10 @@
 """
 GenBank problem cases management
 """
-from intervaltree import IntervalTree
+import re
+from bisect import bisect_right
+from collections import Counter, defaultdict
+from functools import lru_cache
 from gencode_icedb.tsl.genbankProblemCasesSqlite import GenbankProblemCaseSqliteTable
 
 
@@ -10,40 +13,105 @@ def accvToAcc(accv):
     return accv.split('.')[0]
 
 
+def _accGroupKey(acc):
+    """key used to group accessions so that string compares within a group
+    match numeric order; (alpha prefix, length)"""
+    return (re.match("^[A-Za-z_]*", acc).group(0), len(acc))
+
+
+def _strAfter(s):
+    """Return a accession string that is just after the current string for
+    use a an half-open end coordinate"""
+    # not general, doesn't handle overflow, but will work with ASCCI
+    return s[:-1] + chr(ord(s[-1]) + 1)
+
+
+class _AccRangeGroup(object):
+    """Sorted, non-overlapping half-open accession ranges for accessions with
+    the same prefix and length, searched with bisect.  Overlapping input ranges
+    are split into disjoint ranges, keeping the lowest reason."""
+    __slots__ = ("starts", "ends", "reasons")
+
+    def __init__(self, cases):
+        self.starts = []
+        self.ends = []
+        self.reasons = []
+        self._build(cases)
+
+    def _build(self, cases):
+        """single sweep over range start and end events, keeping a count of
+        the reasons of the active ranges"""
+        events = defaultdict(list)
+        for gpc in cases:
+            events[gpc.startAcc].append((gpc.reason, 1))
+            events[_strAfter(gpc.endAcc)].append((gpc.reason, -1))
+        activeCnts = Counter()
+        prevBound = None
+        for bound in sorted(events.keys()):
+            if prevBound is not None:
+                self._addRange(prevBound, bound, min(activeCnts.keys()) if len(activeCnts) > 0 else None)
+            for reason, delta in events[bound]:
+                activeCnts[reason] += delta
+                if activeCnts[reason] == 0:
+                    del activeCnts[reason]
+            prevBound = bound
+
+    def _addRange(self, start, end, reason):
+        if reason is None:
+            pass
+        elif (len(self.ends) > 0) and (self.ends[-1] == start) and (self.reasons[-1] == reason):
+            self.ends[-1] = end  # merge adjacent
+        else:
+            self.starts.append(start)
+            self.ends.append(end)
+            self.reasons.append(reason)
+
+    def find(self, acc):
+        "find reason for accession or None"
+        i = bisect_right(self.starts, acc) - 1
+        if (i >= 0) and (acc < self.ends[i]):
+            return self.reasons[i]
+        return None
+
+
 class GenbankProblemCases(object):
     """Object that looks up GenBank problem cases stored in GenbankProblemCase
-    table in database."""
+    table in database.  Results are cached by accession, as the same evidence
+    is queried for each overlapping gene."""
     # Problem cases are stored by accession range.  Since the lists are
-    # small, they are loaded into memory and an index by accession prefix
+    # small, they are loaded into memory and indexed by accession prefix
+    # and length, as string compares are only numeric within these groups.
 
-    def __init__(self, conn):
-        self.itree = IntervalTree()
+    def __init__(self, conn, cacheSize=65536):
         dbTbl = GenbankProblemCaseSqliteTable(conn)
-        for gpc in dbTbl.genAll():
-            self._addCase(gpc)
+        self._buildGroups(dbTbl.genAll())
+        self._cachedFind = lru_cache(maxsize=cacheSize)(self._find)
+
+    def _buildGroups(self, cases):
+        casesByKey = {}
+        for gpc in cases:
+            self._checkCase(gpc)
+            casesByKey.setdefault(_accGroupKey(gpc.startAcc), []).append(gpc)
+        self.groups = {key: _AccRangeGroup(keyCases) for key, keyCases in casesByKey.items()}
 
     @staticmethod
-    def _strAfter(s):
-        """Return a accession string that is just after the current string for
-        use a an half-open end coordinate"""
-        # not general, doesn't handle overflow, but will work with ASCCI
-        return s[:-1] + chr(ord(s[-1]) + 1)
-
-    def _addCase(self, gpc):
-        # must convert to half-open
-        if len(gpc.startAcc) != len(gpc.endAcc):
-            raise Exception("Accessions strings must be the same for indexing to work: {}".format(gpc))
-        self.itree[gpc.startAcc:self._strAfter(gpc.endAcc)] = gpc
+    def _checkCase(gpc):
+        if _accGroupKey(gpc.startAcc) != _accGroupKey(gpc.endAcc):
+            raise Exception("Accessions strings must have the same prefix and length for indexing to work: {}".format(gpc))
+
+    def _find(self, acc):
+        group = self.groups.get(_accGroupKey(acc))
+        return group.find(acc) if group is not None else None
 
     def isProblem(self, accv):
         """does this accession have a problem """
-        return len(self.itree.search(accvToAcc(accv))) > 0
+        return self.getProblem(accv) is not None
 
     def getProblem(self, accv):
         """get the problem reason or None if no problem.  If multiple problems,
         a the lowest numbered one is returned."""
-        probs = self.itree.search(accvToAcc(accv))
-        if len(probs) == 0:
-            return None
-        else:
-            return min([p.data.reason for p in probs])
+        return self._cachedFind(accvToAcc(accv))
+
+    def cacheInfo(self):
+        "get functools cache statistics for accession lookups"
+        return self._cachedFind.cache_info()
@@ -1,5 +1,6 @@
 """
-Analyze transcript annotations using EvidenceSupport that has been collected.
+Analyze transcript annotations using EvidenceSupport that has been collected
+in the GencodeSupportEval table.
 
 The current algorithm is:
     - tslNA:  transcripts that are:
@@ -8,130 +9,103 @@ The current algorithm is:
               - Immunoglobins
               - T-Cell receptors
               - Single exon genes
+              - non-transcribed pseudogenes
   - multi-exon transcripts:
      - tsl1 - all splice junctions of the transcript are supported by at least one non-suspect mRNA.
      - tsl2 - the best supporting mRNA is flagged as suspect or the support is from multiple ESTs
      - tsl3 - the only support is from a single EST
      - tsl4 - the best supporting EST is flagged as suspect
      - tsl5 - no single transcript supports the model structure
-"""
-from collections import defaultdict
-from pycbio.sys import fileOps
-from gencode_icedb.tsl.supportDefs import EvidenceSupport, TrascriptionSupportLevel
-from gencode_icedb.tsl.supportDefs import transIsSingleExon, geneIsTslIgnored
-from gencode_icedb.tsl.tslModels import GencodeTranscriptSupport
 
+GencodeSupportEval does not record if the supporting evidence is flagged as
+suspect, so suspect evidence is counted as normal support and the
+suspect cases of tsl2 and tsl4 are not assigned.  Transcripts that are not
+evaluated don't have support rows, so the list of all transcripts is needed
+to assign tslNA.
 
-class AnnotationSupport(defaultdict):
-    """Collection of evidence supporting a transcript annotation, index by
-    evidence set uuid"""
-    def __init__(self, transAnnot):
-        self.transAnnot = transAnnot
-        super(AnnotationSupportCollector, self).__init__(list)
+Counts are computed for all transcripts at once by SQL grouped by transcript,
+so only one row per transcript is returned to python.
+"""
+from uuid import UUID
+from peewee import fn, Case
+from gencode_icedb.general.peeweeOps import peeweeBulkInsert
+from gencode_icedb.tsl.supportDefs import EvidenceSupport, EvidenceType, TrascriptionSupportLevel
+from gencode_icedb.tsl.tslModels import GencodeSupportEval, GencodeTranscriptSupport
 
-    def add(self, supportEval):
-        self[supportEval.evidSetUuid].append(supportEval)
 
+def _fullSupportValues():
+    "support values (as stored in database) that support the full structure"
+    return [str(s) for s in EvidenceSupport if s < EvidenceSupport.poor]
 
-class SupportCollector(defaultdict):
-    """Loads support for"""
-    pass
 
+def _noEvalValues():
+    "support values (as stored in database) that indicate transcript was not evaluated"
+    return [str(s) for s in EvidenceSupport if EvidenceSupport.no_eval <= s < EvidenceSupport.worst]
 
-class FullLengthSupportEvaluator(object):
-    """
-    Full-length support evaluation.
-    qualEval is an instance of EvidenceQualityEval that defined the method
-    of the evaluation.
-    allowExtension indicates if new exons should be allowed
-    """
-    def __init__(self, evidenceReader, qualEval, allowExtension=False):
-        self.evidenceReader = evidenceReader
-        self.evaluator = MegSupportEvaluator(qualEval, allowExtension)
-
-    def _countFullSupport(self, supportEvals):
-        """count support from normal and suspect evidence"""
-        supporting = [ev for ev in supportEvals if ev.support < EvidenceSupport.poor]
-        return (len([ev for ev in supporting if ev.suspect is None]),
-                len([ev for ev in supporting if ev.suspect is not None]))
-
-    def _calculateRnaTsl(self, evidCollector):
-        """support from RNAs in a given set"""
-        goodCnt, suspectCnt = self._countFullSupport(evidCollector)
-        if goodCnt >= 1:
-            return TrascriptionSupportLevel.tsl1
-        elif suspectCnt >= 1:
-            return TrascriptionSupportLevel.tsl2
-        else:
-            return TrascriptionSupportLevel.tsl5
-
-    def _calculateEstTsl(self, evidCollector):
-        """support from ESTs in a given set"""
-        goodCnt, suspectCnt = self._countFullSupport(evidCollector)
-        if goodCnt >= 2:
-            return TrascriptionSupportLevel.tsl2
-        elif goodCnt == 1:
-            return TrascriptionSupportLevel.tsl3
-        elif suspectCnt >= 1:
-            return TrascriptionSupportLevel.tsl4
-        else:
-            return TrascriptionSupportLevel.tsl5
-
-    def _calculateTsl(self, evidCollector):
-        """compute TSL from evidence in evidCollector"""
-        ucscRnaTsl = self._calculateRnaTsl(evidCollector[EvidenceSource.UCSC_RNA])
-        ensemblRnaTsl = self._calculateRnaTsl(evidCollector[EvidenceSource.ENSEMBL_RNA])
-        estRnaTsl = self._calculateEstTsl(evidCollector[EvidenceSource.UCSC_EST])
-        return min(ucscRnaTsl, ensemblRnaTsl, estRnaTsl)
-
-    def _writeDetails(self, detailsTsvFh, transAnnot, evidSrc, evidTrans, evidSupport, suspect):
-        fileOps.prRowv(detailsTsvFh, transAnnot.rna.name, evidSrc, evidTrans.rna.name, evidSupport,
-                       "" if suspect is None else suspect)
-
-    def _compareWithEvidence(self, transAnnot, evidSrc, evidTrans, evidCollector, detailsTsvFh):
-        evidSupport = self.evaluator.compare(transAnnot, evidTrans)
-        suspect = evidTrans.attrs.genbankProblem
-        if detailsTsvFh is not None:
-            self._writeDetails(detailsTsvFh, transAnnot, evidSrc, evidTrans, evidSupport, suspect)
-        if evidSupport < EvidenceSupport.poor:
-            evidCollector.add(evidSrc,
-                              AnnotationEvidenceEval(transAnnot, evidSrc, evidTrans.rna.name, evidSupport, suspect))
-
-    def collectTransSupport(self, transAnnot, evidCache, detailsTsvFh=None):
-        """lower-level function to collect evidence for one transcript,
-        returning an AnnotationEvidenceCollector object"""
-        evidCollector = AnnotationEvidenceCollector(transAnnot)
-        for evidSrc in evidCache.sources:
-            for evidTrans in evidCache.get(evidSrc):
-                self._compareWithEvidence(transAnnot, evidSrc, evidTrans, evidCollector, detailsTsvFh)
-        return evidCollector
-
-    def _classifyTrans(self, transAnnot, evidCache, tslTsvFh, detailsTsvFh):
-        if _transIsSingleExon(transAnnot) or _geneIsTslIgnored(transAnnot):
-            tsl = TrascriptionSupportLevel.tslNA
-        else:
-            evidCollector = self.collectTransSupport(transAnnot, evidCache, detailsTsvFh)
-            tsl = self._calculateTsl(evidCollector)
-        fileOps.prRowv(tslTsvFh, transAnnot.rna.name, tsl)
-
-    @staticmethod
-    def writeTsvHeaders(tslTsvFh, detailsTsvFh=None):
-        fileOps.prRowv(tslTsvFh, "transcriptId", "level")
-        if detailsTsvFh is not None:
-            fileOps.prRowv(detailsTsvFh, "transcriptId", "evidSrc", "evidId", "evidSupport", "suspect")
-
-    def classifyGeneTranscripts(self, geneAnnot, tslTsvFh, detailsTsvFh=None):
-        """Classify a list of transcripts, which must be all on the same chromosome.
-        They should be from the same gene locus or overlapping loci for caching efficiency."""
-        evidCache = EvidenceCache(self.evidenceReader, geneAnnot.chrom, geneAnnot.transcriptionStrand)
-        for transAnnot in geneAnnot.transcripts:
-            self._classifyTrans(transAnnot, evidCache, tslTsvFh, detailsTsvFh)
+
+def calculateTsl(noEval, rnaCnt, estCnt):
+    """compute TSL from whether the transcript was not evaluated and
+    the count of full-length supporting RNAs and ESTs"""
+    if noEval:
+        return TrascriptionSupportLevel.tslNA
+    elif rnaCnt >= 1:
+        return TrascriptionSupportLevel.tsl1
+    elif estCnt >= 2:
+        return TrascriptionSupportLevel.tsl2
+    elif estCnt == 1:
+        return TrascriptionSupportLevel.tsl3
+    else:
+        return TrascriptionSupportLevel.tsl5
 
 
 class SupportClassifier(object):
     """
-    Classify transcripts and/or collect statistics based on evidence from a set
-    of database.
+    Classify transcripts based on evidence support from a set of evidence
+    sets stored in the GencodeSupportEval table.  The database must be bound
+    to the models (see tslConnect).
+
+    :param evidSetTypes: dict of evidence set UUID to EvidenceType; EST sets
+           use the EST rules, all others are treated as RNAs.  Evidence sets
+           not in this dict are ignored.
     """
-    # Process by evidence database for all genes to not reopening evidence databases
-    pass
+    def __init__(self, conn, evidSetTypes):
+        self.conn = conn
+        self.rnaEvidSetUuids = [UUID(str(u)) for u, t in evidSetTypes.items() if t != EvidenceType.EST]
+        self.estEvidSetUuids = [UUID(str(u)) for u, t in evidSetTypes.items() if t == EvidenceType.EST]
+
+    def _fullSupportCount(self, evidSetUuids):
+        return fn.SUM(Case(None, [(GencodeSupportEval.support.in_(_fullSupportValues())
+                                   & GencodeSupportEval.evidSetUuid.in_(evidSetUuids),
+                                   GencodeSupportEval.evidCount)],
+                           0))
+
+    def _supportCountsQuery(self):
+        noEval = fn.MAX(Case(None, [(GencodeSupportEval.support.in_(_noEvalValues()), 1)], 0))
+        return (GencodeSupportEval
+                .select(GencodeSupportEval.transcriptId, noEval,
+                        self._fullSupportCount(self.rnaEvidSetUuids),
+                        self._fullSupportCount(self.estEvidSetUuids))
+                .group_by(GencodeSupportEval.transcriptId)
+                .tuples())
+
+    def classify(self, allTranscriptIds=None):
+        """Generator of (transcriptId, TrascriptionSupportLevel) for all
+        transcripts with evaluated support.  If allTranscriptIds is specified,
+        transcripts in it without support are returned as tslNA."""
+        seenIds = set()
+        for transcriptId, noEval, rnaCnt, estCnt in self._supportCountsQuery():
+            seenIds.add(transcriptId)
+            yield (transcriptId, calculateTsl(noEval, rnaCnt, estCnt))
+        if allTranscriptIds is not None:
+            for transcriptId in sorted(frozenset(allTranscriptIds) - seenIds):
+                yield (transcriptId, TrascriptionSupportLevel.tslNA)
+
+    def store(self, allTranscriptIds=None):
+        """classify all transcripts and store in the GencodeTranscriptSupport
+        table, replacing existing rows.  See classify() for allTranscriptIds."""
+        GencodeTranscriptSupport.create_table(fail_silently=True)
+        recs = [{"transcriptId": transcriptId, "level": tsl, "intLevel": tsl.value}
+                for transcriptId, tsl in self.classify(allTranscriptIds)]
+        with self.conn.atomic():
+            GencodeTranscriptSupport.delete().execute()
+            peeweeBulkInsert(self.conn, GencodeTranscriptSupport, recs)
@@ -1,12 +1,15 @@
 """
 Evaluation of transcripts against evidence.
 """
+import numpy as np
 from pycbio.sys import fileOps
-from collections import defaultdict
-from gencode_icedb.general.transFeatures import ExonFeature, ChromInsertFeature, RnaInsertFeature
+from collections import defaultdict, namedtuple, OrderedDict
+from uuid import UUID
+from gencode_icedb.general.dataOps import inCnv
+from gencode_icedb.general.transFeatures import ExonFeature, IntronFeature, ChromInsertFeature, RnaInsertFeature
 from gencode_icedb.tsl.supportDefs import EvidenceSupport
 from gencode_icedb.tsl.supportDefs import transTypeEvidSupport, geneTypeIsEvaulated, transTypeIsEvaulated
-from gencode_icedb.tsl.supportEvalDb import SupportEvidEvalResult, SupportEvalResult
+from gencode_icedb.tsl.supportEvalDb import SupportEvidEvalResult, SupportEvalResult, SupportEvalWriter, writeSupportEvalRec
 
 
 # FIXME: inconsistent names:  transAnnot, transExon, evidTrans, evidExon, geneAnnot
@@ -26,6 +29,12 @@ tightExonPolymorphicFactionLimit = 0.1
 looseExonPolymorphicSizeLimit = 5000
 looseExonPolymorphicFactionLimit = 1.0
 
+# maximum number of evidence alignments with cached quality
+qualCacheSize = 65536
+
+# used to convert array values back to EvidenceSupport without enum lookup
+_supportByValue = {s.value: s for s in EvidenceSupport}
+
 
 def shouldKeepEvidenceSupport(evidSupport):
     "Filter for categories we output"
@@ -110,16 +119,62 @@ class EvidenceQualityEval(object):
         return worstSupport
 
 
+class EvidenceExonMatrix(object):
+    """Exon boundaries of a list of evidence alignments as arrays, used to
+    compare a transcript with many alignments at once.  Rows are the evidence
+    and columns the exons, padded to the maximum number of exons.
+    """
+    def __init__(self, evidCache):
+        self.evidCache = evidCache
+        evidExons = [evidTrans.getFeaturesOfType(ExonFeature) for evidTrans in evidCache]
+        self.exonCnts = np.array([len(exons) for exons in evidExons], dtype=np.int64)
+        maxExons = max(self.exonCnts) if len(evidExons) > 0 else 0
+        self.starts = np.full((len(evidExons), maxExons), -1, dtype=np.int64)
+        self.ends = np.full((len(evidExons), maxExons), -1, dtype=np.int64)
+        for iEvid, exons in enumerate(evidExons):
+            self.starts[iEvid, 0:len(exons)] = [exon.chrom.start for exon in exons]
+            self.ends[iEvid, 0:len(exons)] = [exon.chrom.end for exon in exons]
+        self.valid = np.arange(maxExons)[np.newaxis, :] < self.exonCnts[:, np.newaxis]
+
+
 class MegSupportEvaluator(object):
     """Evaluate a multi-exon annotation against an evidence alignment.  If
     allowExtension is specified, allow evidence to extend beyond annotation.
     qualEval is an instance of EvidenceQualityEval that defined the mention
-    of the evaluation.
+    of the evaluation.  The quality of each evidence alignment only depends
+    on the evidence, so it is cached by evidence object, keeping the
+    qualCacheSize most recently used, or until clearQualityCache() is called.
+    Identity is used rather than location, as the same accession can have
+    multiple alignments to the same range with different indels.  The number
+    of quality checks and cache hits are in qualCheckCnt and qualCacheHitCnt.
     """
     def __init__(self, evidSetUuid, qualEval, allowExtension=False):
         self.evidSetUuid = evidSetUuid
+        self.evidSetUuidObj = inCnv(evidSetUuid, UUID)  # converted once for results
         self.qualEval = qualEval
         self.allowExtension = allowExtension
+        self.qualCache = OrderedDict()  # id(evidTrans) -> (evidTrans, support)
+        self.qualCheckCnt = 0
+        self.qualCacheHitCnt = 0
+
+    def clearQualityCache(self):
+        """clear cached evidence quality, normally done when moving to a new
+        set of evidence.  Counts are not reset."""
+        self.qualCache.clear()
+
+    def _checkEvidQuality(self, evidTrans):
+        entry = self.qualCache.get(id(evidTrans))
+        if entry is not None:
+            self.qualCacheHitCnt += 1
+            self.qualCache.move_to_end(id(evidTrans))
+            return entry[1]
+        support = self.qualEval.check(evidTrans)
+        self.qualCheckCnt += 1
+        # save evidTrans so id is not reused while cached
+        self.qualCache[id(evidTrans)] = (evidTrans, support)
+        if len(self.qualCache) > qualCacheSize:
+            self.qualCache.popitem(last=False)
+        return support
 
     def _findEvidExonRangeStart(self, transAnnot, evidTrans):
         firstAnnotExon = transAnnot.features[0]
@@ -211,8 +266,8 @@ class MegSupportEvaluator(object):
         else:
             offset5, offset3, extend5Exons, extend3Exons = lastOffset, firstOffset, lastExtend, firstExtend
         evidName = evidTrans.rna.name if evidTrans is not None else None
-        return SupportEvidEvalResult(transAnnot.rna.name, self.evidSetUuid, evidName, support,
-                                     offset5, offset3, extend5Exons, extend3Exons)
+        return SupportEvidEvalResult.fromTyped(transAnnot.rna.name, self.evidSetUuidObj, evidName, support,
+                                               offset5, offset3, extend5Exons, extend3Exons)
 
     def _compareFeatures(self, transAnnot, evidTrans, qualEvalSupport, firstEvidExon, lastEvidExon):
         # This assumes that the number of evidence exons has been checked to be
@@ -253,7 +308,7 @@ class MegSupportEvaluator(object):
     def _compareMegWithEvidenceImpl(self, transAnnot, evidTrans):
         """Compare a multi-exon annotation with a given piece of evidence"""
         # check evidence quality first, this will be used to adjust good support
-        qualEvalSupport = self.qualEval.check(evidTrans)
+        qualEvalSupport = self._checkEvidQuality(evidTrans)
         worstSupport = qualEvalSupport
         if not keepEvidEval(worstSupport):
             return self._mkSupportEvidEvalResults(transAnnot, evidTrans, worstSupport)
@@ -282,33 +337,197 @@ class MegSupportEvaluator(object):
         except Exception as ex:
             raise Exception("Bug evaluating {} with {}".format(transAnnot.rna.name, evidTrans.rna.name)) from ex
 
+    _good = EvidenceSupport.good.value
+    _extendsExons = EvidenceSupport.extends_exons.value
+    _featMismatch = EvidenceSupport.feat_mismatch.value
+    _featCountMismatch = EvidenceSupport.feat_count_mismatch.value
+
+    def _compareFirstExons(self, annotStart, annotEnd, evidStarts, evidEnds, iFirst):
+        "vectorized _compareFirstExon, returns (supports, offsets, extraExons)"
+        hasPrev = iFirst > 0
+        extends = hasPrev & (evidStarts == annotStart) if self.allowExtension else np.zeros(len(iFirst), dtype=bool)
+        supports = np.where(evidEnds != annotEnd, self._featMismatch,
+                            np.where(hasPrev, np.where(extends, self._extendsExons, self._featMismatch), self._good))
+        offsets = np.where(hasPrev, 0, annotStart - evidStarts)
+        return supports, offsets, np.where(extends, iFirst, 0)
+
+    def _compareLastExons(self, annotStart, annotEnd, evidStarts, evidEnds, iLast, exonCnts):
+        "vectorized _compareLastExon, returns (supports, offsets, extraExons)"
+        hasNext = iLast < exonCnts - 1
+        extends = hasNext & (evidEnds == annotEnd) if self.allowExtension else np.zeros(len(iLast), dtype=bool)
+        supports = np.where(evidStarts != annotStart, self._featMismatch,
+                            np.where(hasNext, np.where(extends, self._extendsExons, self._featMismatch), self._good))
+        offsets = np.where(hasNext, 0, evidEnds - annotEnd)
+        return supports, offsets, np.where(extends, exonCnts - 1 - iLast, 0)
+
+    def _compareMatrixImpl(self, transAnnot, annotExons, evidMatrix, evidIdxs):
+        """returns list of SupportEvidEvalResult, or None for evidence that
+        must be compared with compare()"""
+        nAnnot = len(annotExons)
+        annotStarts = np.array([exon.chrom.start for exon in annotExons], dtype=np.int64)
+        annotEnds = np.array([exon.chrom.end for exon in annotExons], dtype=np.int64)
+        rows = np.arange(len(evidIdxs))
+        starts, ends = evidMatrix.starts[evidIdxs], evidMatrix.ends[evidIdxs]
+        valid, exonCnts = evidMatrix.valid[evidIdxs], evidMatrix.exonCnts[evidIdxs]
+        qualSupports = np.array([self._checkEvidQuality(evidMatrix.evidCache[iEvid]).value for iEvid in evidIdxs], dtype=np.int64)
+        qualOk = (qualSupports < EvidenceSupport.poor.value) | (qualSupports == self._extendsExons)
+        countOk = (exonCnts >= nAnnot) if self.allowExtension else (exonCnts == nAnnot)
+
+        # range of evidence exons overlapping first and last annotation exons
+        startHits = valid & (ends >= annotStarts[0])
+        iFirst = startHits.argmax(axis=1)
+        rangeOk = startHits.any(axis=1) & (starts[rows, iFirst] <= annotEnds[0])
+        endHits = valid & (starts <= annotEnds[-1])
+        iEndHit = starts.shape[1] - 1 - endHits[:, ::-1].argmax(axis=1)
+        rangeOk &= endHits.any(axis=1) & (ends[rows, iEndHit] >= annotStarts[-1])
+
+        # evidence exons aligned with annotation exons, starting at iFirst
+        iLast = iFirst + nAnnot - 1
+        cols = np.minimum(iFirst[:, np.newaxis] + np.arange(nAnnot)[np.newaxis, :], starts.shape[1] - 1)
+        alignStarts, alignEnds = starts[rows[:, np.newaxis], cols], ends[rows[:, np.newaxis], cols]
+        firstSupports, firstOffsets, firstExtends = self._compareFirstExons(annotStarts[0], annotEnds[0],
+                                                                            alignStarts[:, 0], alignEnds[:, 0], iFirst)
+        internalOk = (np.all(alignStarts[:, 1:-1] == annotStarts[1:-1], axis=1)
+                      & np.all(alignEnds[:, 1:-1] == annotEnds[1:-1], axis=1))
+        lastSupports, lastOffsets, lastExtends = self._compareLastExons(annotStarts[-1], annotEnds[-1],
+                                                                        alignStarts[:, -1], alignEnds[:, -1], iLast, exonCnts)
+        supports = np.maximum(np.maximum(qualSupports, firstSupports), lastSupports)
+        supports[~internalOk] = self._featMismatch
+        matched = supports != self._featMismatch
+
+        # cases where the evidence runs out of exons are left to compare()
+        useScalar = qualOk & countOk & rangeOk & (iLast >= exonCnts)
+        supports = np.where(~qualOk, qualSupports,
+                            np.where(~countOk, np.maximum(qualSupports, self._featCountMismatch),
+                                     np.where(~rangeOk, self._featMismatch, supports)))
+        haveOffsets = qualOk & countOk & rangeOk & matched
+        results = []
+        for iRow, iEvid in enumerate(evidIdxs):
+            if useScalar[iRow]:
+                results.append(None)
+            elif haveOffsets[iRow]:
+                results.append(self._mkSupportEvidEvalResults(transAnnot, evidMatrix.evidCache[iEvid], _supportByValue[int(supports[iRow])],
+                                                              int(firstOffsets[iRow]), int(lastOffsets[iRow]),
+                                                              int(firstExtends[iRow]), int(lastExtends[iRow])))
+            else:
+                results.append(self._mkSupportEvidEvalResults(transAnnot, evidMatrix.evidCache[iEvid], _supportByValue[int(supports[iRow])]))
+        return results
+
+    def compareMatrix(self, transAnnot, evidMatrix, evidIdxs):
+        """Compare a multi-exon annotation with the evidence in an
+        EvidenceExonMatrix selected by the list evidIdxs, returning a list of
+        SupportEvidEvalResult objects.  This gives the same results as
+        compare(), with the exon boundaries of all the evidence compared at
+        once."""
+        annotExons = transAnnot.getFeaturesOfType(ExonFeature)
+        if debug or (len(annotExons) < 2) or (len(evidIdxs) == 0):
+            return [self.compare(transAnnot, evidMatrix.evidCache[iEvid]) for iEvid in evidIdxs]
+        results = self._compareMatrixImpl(transAnnot, annotExons, evidMatrix, np.asarray(evidIdxs, dtype=np.intp))
+        return [result if result is not None else self.compare(transAnnot, evidMatrix.evidCache[iEvid])
+                for iEvid, result in zip(evidIdxs, results)]
+
+    def prunedResults(self, transAnnot, evidMatrix, evidIdxs):
+        """Get SupportEvidEvalResult objects for evidence in an
+        EvidenceExonMatrix that was pruned by EvidenceIntronIndex, so can't
+        match the first or last exon boundaries of a multi-exon annotation.
+        This gives the same results as compare() from the evidence quality
+        and exon count, without comparing exons."""
+        nAnnot = len(transAnnot.getFeaturesOfType(ExonFeature))
+        results = []
+        for iEvid in evidIdxs:
+            evidTrans = evidMatrix.evidCache[iEvid]
+            support = self._checkEvidQuality(evidTrans)
+            if keepEvidEval(support):
+                exonCnt = evidMatrix.exonCnts[iEvid]
+                countOk = (exonCnt >= nAnnot) if self.allowExtension else (exonCnt == nAnnot)
+                support = EvidenceSupport.feat_mismatch if countOk else max(support, EvidenceSupport.feat_count_mismatch)
+            results.append(self._mkSupportEvidEvalResults(transAnnot, evidTrans, support))
+        return results
+
+
+class EvidenceIntronIndex(object):
+    """Index of the evidence for a gene by intron start and end positions,
+    used to find the evidence that could support a transcript.  Supporting
+    evidence must have an intron starting at the end of the transcript's first
+    exon and one ending at the start of its last exon, as the boundaries of
+    these exons must match and be followed or preceded by another exon.
+    """
+    def __init__(self, evidCache):
+        self.evidCache = evidCache
+        self.byIntronStart = defaultdict(set)
+        self.byIntronEnd = defaultdict(set)
+        for iEvid, evidTrans in enumerate(evidCache):
+            for evidIntron in evidTrans.getFeaturesOfType(IntronFeature):
+                self.byIntronStart[evidIntron.chrom.start].add(iEvid)
+                self.byIntronEnd[evidIntron.chrom.end].add(iEvid)
+
+    def getCandidateIdxs(self, transAnnot):
+        """get the indexes in evidCache of evidence that could support
+        transAnnot, in order"""
+        firstExon = transAnnot.firstFeature(ExonFeature)
+        lastExon = transAnnot.lastFeature(ExonFeature)
+        if firstExon is lastExon:
+            return list(range(len(self.evidCache)))  # not used for single-exon
+        startIdxs = self.byIntronStart.get(firstExon.chrom.end)
+        endIdxs = self.byIntronEnd.get(lastExon.chrom.start)
+        if (startIdxs is None) or (endIdxs is None):
+            return []
+        return sorted(startIdxs & endIdxs)
+
+    def getCandidates(self, transAnnot):
+        """get the evidence that could support transAnnot, in the order of
+        evidCache"""
+        return [self.evidCache[iEvid] for iEvid in self.getCandidateIdxs(transAnnot)]
+
 
 class FullLengthSupportEvaluator(object):
     """
-    Full-length support evaluation.
+    Full-length support evaluation.  The evidenceReader may return alignments
+    from multiple evidence sets (see MultiEvidenceAlignsReader), in which
+    case each transcript is evaluated against each set, with annotations
+    and evidence only being read once.
     :param qualEval: is an instance of EvidenceQualityEval that defined the method
            of the evaluation.
     :param allowExtension: indicates if new exons should be allowed
+
+    Transcripts are only compared with evidence that could support them, as
+    found with EvidenceIntronIndex.  When writing details, the records for the
+    pruned evidence are obtained with MegSupportEvaluator.prunedResults(), so
+    the details are complete.  The number of transcript and evidence pairs
+    pruned is in prunedCnt.
     """
     def __init__(self, evidenceReader, qualEval, allowExtension=False):
         self.evidenceReader = evidenceReader
-        self.evaluator = MegSupportEvaluator(evidenceReader.evidSetUuid,
-                                             qualEval, allowExtension)
-
-    def _compareWithEvidence(self, transAnnot, evidTrans, detailsTsvFh):
-        evidEvalResult = self.evaluator.compare(transAnnot, evidTrans)
+        self.evaluators = {evidSetUuid: MegSupportEvaluator(evidSetUuid, qualEval, allowExtension)
+                           for evidSetUuid in evidenceReader.evidSetUuids}
+        self.evidSetUuids = evidenceReader.evidSetUuids
+        self.prunedCnt = 0
+
+    def getQualityCheckCounts(self):
+        "get counts of (evidence quality checks, cache hits) over all evidence sets"
+        return (sum([e.qualCheckCnt for e in self.evaluators.values()]),
+                sum([e.qualCacheHitCnt for e in self.evaluators.values()]))
+
+    def _getEvaluator(self, evidSetUuid):
+        if evidSetUuid is None:
+            if len(self.evidSetUuids) != 1:
+                raise Exception("evidSetUuid must be specified when evaluating multiple evidence sets")
+            evidSetUuid = self.evidSetUuids[0]
+        return self.evaluators[evidSetUuid]
+
+    def _writeDetails(self, evaluator, transAnnot, evidMatrix, evidIdxs, evidEvalResults, detailsTsvFh):
+        "write details for all evidence in evidMatrix, in order, including evidence not in evidIdxs"
+        resultsByIdx = dict(zip(evidIdxs, evidEvalResults))
+        prunedIdxs = [iEvid for iEvid in range(len(evidMatrix.evidCache)) if iEvid not in resultsByIdx]
+        resultsByIdx.update(zip(prunedIdxs, evaluator.prunedResults(transAnnot, evidMatrix, prunedIdxs)))
+        for iEvid in range(len(evidMatrix.evidCache)):
+            writeSupportEvalRec(detailsTsvFh, resultsByIdx[iEvid])
+
+    def _collectSupportEvid(self, evaluator, transAnnot, evidMatrix, evidIdxs, detailsTsvFh):
+        evidEvalResults = evaluator.compareMatrix(transAnnot, evidMatrix, evidIdxs)
         if detailsTsvFh is not None:
-            fileOps.prRow(detailsTsvFh, evidEvalResult.toRow())
-        if keepEvidEval(evidEvalResult.support):
-            return evidEvalResult
-        else:
-            return None
-
-    def _collectSupportEvid(self, transAnnot, evidCache, detailsTsvFh):
-        for evidTrans in evidCache:
-            evr = self._compareWithEvidence(transAnnot, evidTrans, detailsTsvFh)
-            if evr is not None:
-                yield evr
+            self._writeDetails(evaluator, transAnnot, evidMatrix, evidIdxs, evidEvalResults, detailsTsvFh)
+        return [evr for evr in evidEvalResults if keepEvidEval(evr.support)]
 
     def _betterAlign(self, evr, evr0):
         if ((evr0 is None)
@@ -319,31 +538,47 @@ class FullLengthSupportEvaluator(object):
         else:
             return evr0
 
-    def collectSupportEvid(self, transAnnot, evidCache, detailsTsvFh=None):
+    def collectSupportEvid(self, transAnnot, evidCache, detailsTsvFh=None, evidSetUuid=None):
         """lower-level function to collect all evidence for one transcript,
         returning an list of SupportEvidEvalResult objects. If there are
         multiple occurrences of the same id, pick the best.  This happens when
-        RNAs are combined from two sources."""
+        RNAs are combined from two sources.  The evidCache must only contain
+        evidence from evidSetUuid, which maybe None if there is only one
+        evidence set."""
+        return self._collectBestSupportEvid(self._getEvaluator(evidSetUuid), transAnnot, EvidenceExonMatrix(evidCache),
+                                            list(range(len(evidCache))), detailsTsvFh)
+
+    def _collectBestSupportEvid(self, evaluator, transAnnot, evidMatrix, evidIdxs, detailsTsvFh):
         worstSupport = transTypeEvidSupport(transAnnot)
         if worstSupport != EvidenceSupport.good:
-            return [SupportEvidEvalResult(transAnnot.rna.name, self.evidenceReader.evidSetUuid, None, worstSupport)]
+            return [SupportEvidEvalResult.fromTyped(transAnnot.rna.name, evaluator.evidSetUuidObj, None, worstSupport)]
         evrById = {}
-        for result in self._collectSupportEvid(transAnnot, evidCache, detailsTsvFh):
+        for result in self._collectSupportEvid(evaluator, transAnnot, evidMatrix, evidIdxs, detailsTsvFh):
             evrById[result.evidId] = self._betterAlign(result, evrById.get(result.evidId))
         if len(evrById) == 0:
-            return [SupportEvidEvalResult(transAnnot.rna.name, self.evidenceReader.evidSetUuid, None, EvidenceSupport.no_support)]
+            return [SupportEvidEvalResult.fromTyped(transAnnot.rna.name, evaluator.evidSetUuidObj, None, EvidenceSupport.no_support)]
         return list(sorted(evrById.values(), key=lambda r: r.evidId))
 
     @staticmethod
     def writeTsvHeaders(supportEvalTsvFh, detailsTsvFh=None):
-        fileOps.prRow(supportEvalTsvFh, SupportEvalResult.tsvHeader())
-        if detailsTsvFh is not None:
+        "write TSV headers, outputs that are SupportEvalWriter objects are skipped"
+        if not isinstance(supportEvalTsvFh, SupportEvalWriter):
+            fileOps.prRow(supportEvalTsvFh, SupportEvalResult.tsvHeader())
+        if (detailsTsvFh is not None) and not isinstance(detailsTsvFh, SupportEvalWriter):
             fileOps.prRow(detailsTsvFh, SupportEvidEvalResult.tsvHeader())
 
     def getEvidenceCache(self, annot):
         """get array of all evidence overlapping a gene or transcript annotation"""
         return tuple(self.evidenceReader.genOverlapping(annot.chrom, transcriptionStrand=annot.transcriptionStrand, minExons=2))
 
+    def splitEvidenceCache(self, evidCache):
+        """split an evidence cache into a list of (evidSetUuid, evidence) in the
+        order of the evidence sets"""
+        evidBySet = {evidSetUuid: [] for evidSetUuid in self.evidSetUuids}
+        for evidTrans in evidCache:
+            evidBySet[evidTrans.attrs.evidSetUuid].append(evidTrans)
+        return [(evidSetUuid, evidBySet[evidSetUuid]) for evidSetUuid in self.evidSetUuids]
+
     def _combineSupportEvid(self, evidEvalResults):
         """combine SupportEvidEvalResult objects into a SupportEvalResult object."""
         evr = evidEvalResults[0]
@@ -355,10 +590,10 @@ class FullLengthSupportEvaluator(object):
             bestExtend5Exon = max(bestExtend5Exon, evr.extend5Exons)
             bestExtend3Exon = max(bestExtend3Exon, evr.extend3Exons)
         cnt = len(evidEvalResults) if bestSupport < EvidenceSupport.no_support else 0
-        return SupportEvalResult(evr.transcriptId, self.evidenceReader.evidSetUuid,
-                                 EvidenceSupport(bestSupport), cnt,
-                                 bestOffset5, bestOffset3,
-                                 bestExtend5Exon, bestExtend3Exon)
+        return SupportEvalResult.fromTyped(evr.transcriptId, evr.evidSetUuid,
+                                           EvidenceSupport(bestSupport), cnt,
+                                           bestOffset5, bestOffset3,
+                                           bestExtend5Exon, bestExtend3Exon)
 
     def _splitBySupport(self, evidEvalResults):
         evidEvalBySupport = defaultdict(list)
@@ -378,18 +613,82 @@ class FullLengthSupportEvaluator(object):
         # sort for testing
         return sorted(evalResults)
 
-    def _evaulateTrans(self, transAnnot, evidCache, supportEvalTsvFh, detailsTsvFh):
+    def _evaulateTrans(self, transAnnot, evidSetUuid, evidIndex, evidMatrix, supportEvalTsvFh, detailsTsvFh):
         """get best supporting evidence and write to file, along with a
         count."""
-        evidEvalResults = self.collectSupportEvid(transAnnot, evidCache, detailsTsvFh)
+        evidIdxs = evidIndex.getCandidateIdxs(transAnnot)
+        self.prunedCnt += len(evidIndex.evidCache) - len(evidIdxs)
+        evidEvalResults = self._collectBestSupportEvid(self.evaluators[evidSetUuid], transAnnot, evidMatrix, evidIdxs, detailsTsvFh)
         for evalResult in self._mergeSupportEvidResults(evidEvalResults):
-            fileOps.prRow(supportEvalTsvFh, evalResult.toRow())
+            writeSupportEvalRec(supportEvalTsvFh, evalResult)
 
     def evaluateGeneTranscripts(self, geneAnnot, supportEvalTsvFh, detailsTsvFh=None):
         """Evaluate a list of transcripts, which must be all on the same chromosome.
-        They should be from the same gene locus or overlapping loci for caching efficiency."""
+        They should be from the same gene locus or overlapping loci for caching efficiency.
+        Each transcript is evaluated against each evidence set.  The outputs
+        maybe TSV file handles or SupportEvalWriter objects."""
+        if geneTypeIsEvaulated(geneAnnot):
+            self.evaluateGeneTranscriptsWithEvidence(geneAnnot, self.getEvidenceCache(geneAnnot),
+                                                     supportEvalTsvFh, detailsTsvFh)
+
+    def evaluateGeneTranscriptsWithEvidence(self, geneAnnot, evidCache, supportEvalTsvFh, detailsTsvFh=None):
+        """Evaluate transcripts with evidence obtained from getEvidenceCache(),
+        which allows the evidence to be shared by multiple evaluators."""
         if geneTypeIsEvaulated(geneAnnot):
-            evidCache = self.getEvidenceCache(geneAnnot)
+            for evaluator in self.evaluators.values():
+                evaluator.clearQualityCache()
+            evidIndexes = [(evidSetUuid, EvidenceIntronIndex(evidSetCache), EvidenceExonMatrix(evidSetCache))
+                           for evidSetUuid, evidSetCache in self.splitEvidenceCache(evidCache)]
             for transAnnot in geneAnnot.transcripts:
                 if transTypeIsEvaulated(transAnnot):
-                    self._evaulateTrans(transAnnot, evidCache, supportEvalTsvFh, detailsTsvFh)
+                    for evidSetUuid, evidIndex, evidMatrix in evidIndexes:
+                        self._evaulateTrans(transAnnot, evidSetUuid, evidIndex, evidMatrix, supportEvalTsvFh, detailsTsvFh)
+
+
+class SupportEvalConfig(namedtuple("SupportEvalConfig",
+                                   ("configId", "qualEval", "allowExtension"))):
+    """A set of parameters for full-length support evaluation, configId is
+    used to identify the output for the configuration."""
+    __slots__ = ()
+
+
+# standard configurations, by configId
+standardEvalConfigs = {config.configId: config for config in (
+    SupportEvalConfig("tight", EvidenceQualityEval(tightExonPolymorphicSizeLimit, tightExonPolymorphicFactionLimit), False),
+    SupportEvalConfig("tight_extend", EvidenceQualityEval(tightExonPolymorphicSizeLimit, tightExonPolymorphicFactionLimit), True),
+    SupportEvalConfig("loose", EvidenceQualityEval(looseExonPolymorphicSizeLimit, looseExonPolymorphicFactionLimit), False),
+    SupportEvalConfig("loose_extend", EvidenceQualityEval(looseExonPolymorphicSizeLimit, looseExonPolymorphicFactionLimit), True))}
+
+
+class MultiConfigSupportEvaluator(object):
+    """
+    Full-length support evaluation with multiple configurations.  Evidence is
+    read once for each gene and evaluated with each configuration, with results
+    written to separate output files for each configuration.
+    :param configs: list of SupportEvalConfig objects
+    """
+    def __init__(self, evidenceReader, configs):
+        self.evidenceReader = evidenceReader
+        self.configIds = tuple([config.configId for config in configs])
+        if len(set(self.configIds)) != len(self.configIds):
+            raise Exception("duplicate evaluation configuration ids: {}".format(", ".join(self.configIds)))
+        self.evaluators = {config.configId: FullLengthSupportEvaluator(evidenceReader, config.qualEval, config.allowExtension)
+                           for config in configs}
+
+    @staticmethod
+    def writeTsvHeaders(outputs):
+        """write headers to outputs, which is a dict of configId to
+        (supportEvalTsvFh, detailsTsvFh), with detailsTsvFh optional"""
+        for supportEvalTsvFh, detailsTsvFh in outputs.values():
+            FullLengthSupportEvaluator.writeTsvHeaders(supportEvalTsvFh, detailsTsvFh)
+
+    def evaluateGeneTranscripts(self, geneAnnot, outputs):
+        """Evaluate the transcripts of a gene with each configuration, outputs
+        is a dict of configId to (supportEvalTsvFh, detailsTsvFh), with
+        detailsTsvFh optional"""
+        if geneTypeIsEvaulated(geneAnnot):
+            evidCache = self.evaluators[self.configIds[0]].getEvidenceCache(geneAnnot)
+            for configId in self.configIds:
+                supportEvalTsvFh, detailsTsvFh = outputs[configId]
+                self.evaluators[configId].evaluateGeneTranscriptsWithEvidence(geneAnnot, evidCache,
+                                                                              supportEvalTsvFh, detailsTsvFh)
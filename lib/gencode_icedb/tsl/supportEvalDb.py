@@ -1,13 +1,24 @@
 """
 Results of support evaluation of transcripts against a single evidence sources.
-These can be stored in a file or database.  Output is to a TSV which are then
-loaded into a database.
+These can be stored in a file or database.  Output is to a TSV or a binary
+file which are then loaded into a database.
 """
+import sys
+import struct
+import zlib
+import gzip
+import queue
+import threading
+from array import array
 from collections import namedtuple
 from uuid import UUID
+from pycbio.sys import fileOps
 from gencode_icedb.tsl.supportDefs import EvidenceSupport
 from gencode_icedb.general.dataOps import outCnv, inCnv
 
+# file extension used to select binary output
+SUPPORT_EVAL_BIN_EXT = ".bin"
+
 
 class SupportEvidEvalResult(namedtuple("SupportEvidEvalEval",
                                        ("transcriptId", "evidSetUuid", "evidId", "support",
@@ -16,14 +27,21 @@ class SupportEvidEvalResult(namedtuple("SupportEvidEvalEval",
     """Evaluation of an annotation against an item of evidence.
     This is the output of collection jobs that will later be combined
     and stored in a database. The evidId argument maybe None"""
-    slots = ()
+    __slots__ = ()
 
     def __new__(cls, transcriptId, evidSetUuid, evidId, support, offset5=0, offset3=0, extend5Exons=0, extend3Exons=0):
-        return super(SupportEvidEvalResult, cls).__new__(cls, transcriptId, inCnv(evidSetUuid, UUID), evidId,
+        return super(SupportEvidEvalResult, cls).__new__(cls, sys.intern(transcriptId), inCnv(evidSetUuid, UUID), evidId,
                                                          EvidenceSupport(support),
                                                          int(offset5), int(offset3),
                                                          int(extend5Exons), int(extend3Exons))
 
+    @classmethod
+    def fromTyped(cls, transcriptId, evidSetUuid, evidId, support, offset5=0, offset3=0, extend5Exons=0, extend3Exons=0):
+        """Fast constructor used during evaluation, with no type conversions.
+        The evidSetUuid must be a UUID and support an EvidenceSupport.  The
+        transcriptId is interned, as there are many results per transcript."""
+        return tuple.__new__(cls, (sys.intern(transcriptId), evidSetUuid, evidId, support, offset5, offset3, extend5Exons, extend3Exons))
+
     @classmethod
     def tsvHeader(cls):
         return cls._fields
@@ -60,12 +78,20 @@ class SupportEvalResult(namedtuple("SupportEvalResult",
     __slots__ = ()
 
     def __new__(cls, transcriptId, evidSetUuid, support, evidCount, offset5, offset3, extend5Exons=0, extend3Exons=0):
-        return super(SupportEvalResult, cls).__new__(cls, transcriptId,
+        return super(SupportEvalResult, cls).__new__(cls, sys.intern(transcriptId),
                                                      inCnv(evidSetUuid, UUID),
                                                      EvidenceSupport(support),
                                                      int(evidCount),
                                                      int(offset5), int(offset3),
                                                      int(extend5Exons), int(extend3Exons))
+
+    @classmethod
+    def fromTyped(cls, transcriptId, evidSetUuid, support, evidCount, offset5, offset3, extend5Exons=0, extend3Exons=0):
+        """Fast constructor used during evaluation, with no type conversions.
+        The evidSetUuid must be a UUID and support an EvidenceSupport.  The
+        transcriptId is interned, as there are many results per transcript."""
+        return tuple.__new__(cls, (sys.intern(transcriptId), evidSetUuid, support, evidCount, offset5, offset3, extend5Exons, extend3Exons))
+
     @classmethod
     def tsvHeader(cls):
         return cls._fields
@@ -73,3 +99,320 @@ class SupportEvalResult(namedtuple("SupportEvalResult",
     def toRow(self):
         """convert to a TVS row"""
         return [str(getattr(self, f)) for f in self._fields]
+
+
+def isSupportEvalBin(path):
+    "is this the path to a binary results file, based on extension"
+    return path.endswith(SUPPORT_EVAL_BIN_EXT)
+
+
+# Binary results files are a header followed by blocks of records stored by
+# column.  UUIDs and strings are dictionary-encoded, with entries added to the
+# dictionaries in the block where they are first used.  EvidenceSupport is
+# stored as its integer value.  All values are little-endian.
+#   header: magic, version, record type code
+#   block: numRows, numNewUuids, new UUID bytes, numNewStrs, strsSize,
+#          NUL-separated strings, columns
+_binMagic = b"ICEDBSE"
+_binVersion = 1
+_binHeaderStruct = struct.Struct("<7sBc")
+_binCountStruct = struct.Struct("<I")
+_binStrsStruct = struct.Struct("<II")
+_binNullIdx = 0xFFFFFFFF
+
+# column encodings
+_UUID = "uuid"
+_STR = "str"
+_SUPPORT = "support"
+_INT = "int"
+
+_binTypecodes = {_UUID: "I", _STR: "I", _SUPPORT: "h", _INT: "i"}
+
+# record type code and column encodings
+_binRecSpecs = {
+    SupportEvalResult: (b"S", (_STR, _UUID, _SUPPORT, _INT, _INT, _INT, _INT, _INT)),
+    SupportEvidEvalResult: (b"D", (_STR, _UUID, _STR, _SUPPORT, _INT, _INT, _INT, _INT)),
+}
+_binRecClasses = {code: recCls for recCls, (code, encs) in _binRecSpecs.items()}
+
+_supportByValue = {s.value: s for s in EvidenceSupport}
+
+
+def _arrayToBytes(arr):
+    if sys.byteorder != "little":
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _arrayFromBytes(typecode, buf):
+    arr = array(typecode)
+    arr.frombytes(buf)
+    if sys.byteorder != "little":
+        arr.byteswap()
+    return arr
+
+
+class SupportEvalRecFilter(object):
+    """Select SupportEvalResult or SupportEvidEvalResult records to write,
+    allowing cheaper details output.  Records must pass all specified criteria.
+
+    :param supports: only keep records with these EvidenceSupport values
+    :param transcriptIds: only keep records for these transcripts
+    :param sampleFraction: keep this fraction of records. Sampling is done by
+           a hash of transcript and evidence ids, so the same records are
+           selected on each run.
+    """
+    def __init__(self, supports=None, transcriptIds=None, sampleFraction=None):
+        self.supports = frozenset(supports) if supports is not None else None
+        self.transcriptIds = frozenset(transcriptIds) if transcriptIds is not None else None
+        self.sampleLimit = int(sampleFraction * 0x100000000) if sampleFraction is not None else None
+
+    def _sampled(self, rec):
+        key = "{}\t{}".format(rec.transcriptId, outCnv(getattr(rec, "evidId", None)))
+        return zlib.crc32(key.encode()) < self.sampleLimit
+
+    def keep(self, rec):
+        "should the record be written?"
+        return (((self.supports is None) or (rec.support in self.supports))
+                and ((self.transcriptIds is None) or (rec.transcriptId in self.transcriptIds))
+                and ((self.sampleLimit is None) or self._sampled(rec)))
+
+
+class SupportEvalWriter(object):
+    """Base class for buffered writers of SupportEvalResult or
+    SupportEvidEvalResult records.  The optional recFilter is a
+    SupportEvalRecFilter object.  Derived classes implement _writeRec(rec),
+    which buffers a record, and flush(), which writes the buffered records."""
+    def __init__(self, fh, recCls, recFilter=None):
+        self.fh = fh
+        self.recCls = recCls
+        self.recFilter = recFilter
+
+    def write(self, rec):
+        "write a record, if it passes the filter"
+        if (self.recFilter is None) or self.recFilter.keep(rec):
+            self._writeRec(rec)
+
+    def close(self):
+        "flush buffered records, the file handle is not closed"
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excVal, excTb):
+        self.close()
+
+
+class SupportEvalTsvWriter(SupportEvalWriter):
+    """Write SupportEvalResult or SupportEvidEvalResult records to a TSV,
+    collecting batchSize records and formatting them with one write.
+    The header is written when created."""
+    def __init__(self, fh, recCls, batchSize=4096, recFilter=None):
+        super(SupportEvalTsvWriter, self).__init__(fh, recCls, recFilter)
+        self.batchSize = batchSize
+        self.recs = []
+        self.fh.write("\t".join(recCls.tsvHeader()) + "\n")
+
+    def _writeRec(self, rec):
+        self.recs.append(rec)
+        if len(self.recs) >= self.batchSize:
+            self.flush()
+
+    def flush(self):
+        "write buffered records"
+        if len(self.recs) > 0:
+            self.fh.write("".join(["\t".join(rec.toRow()) + "\n" for rec in self.recs]))
+            self.recs = []
+
+
+class GzipThreadWriter(object):
+    """File-like object to write a gzip file with compression done in a
+    background thread, which runs in parallel with the evaluation since zlib
+    releases the GIL.  Only write() and close() are supported."""
+    def __init__(self, path, compressLevel=6, maxQueued=64):
+        self.path = path
+        self.queue = queue.Queue(maxQueued)
+        self.error = None
+        self.thread = threading.Thread(target=self._compress, args=(compressLevel,), daemon=True)
+        self.thread.start()
+
+    def _compress(self, compressLevel):
+        try:
+            with gzip.open(self.path, "wb", compresslevel=compressLevel) as fh:
+                while True:
+                    buf = self.queue.get()
+                    if buf is None:
+                        break
+                    fh.write(buf.encode())
+        except Exception as ex:
+            self.error = ex
+            while self.queue.get() is not None:  # drain so writer doesn't block
+                pass
+
+    def _checkError(self):
+        if self.error is not None:
+            raise Exception("error writing {}".format(self.path)) from self.error
+
+    def write(self, buf):
+        self._checkError()
+        self.queue.put(buf)
+
+    def close(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        self._checkError()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excVal, excTb):
+        self.close()
+
+
+class SupportEvalBinWriter(SupportEvalWriter):
+    """Write SupportEvalResult or SupportEvidEvalResult records to a binary
+    file, buffering blockSize records."""
+    def __init__(self, fh, recCls, blockSize=4096, recFilter=None):
+        super(SupportEvalBinWriter, self).__init__(fh, recCls, recFilter)
+        self.code, self.encs = _binRecSpecs[recCls]
+        self.blockSize = blockSize
+        self.uuidIdxs = {}
+        self.strIdxs = {}
+        self._newBlock()
+        self.fh.write(_binHeaderStruct.pack(_binMagic, _binVersion, self.code))
+
+    def _newBlock(self):
+        self.newUuids = []
+        self.newStrs = []
+        self.columns = [array(_binTypecodes[enc]) for enc in self.encs]
+        self.numRows = 0
+
+    def _dictIdx(self, value, idxs, newValues):
+        if value is None:
+            return _binNullIdx
+        idx = idxs.get(value)
+        if idx is None:
+            idx = idxs[value] = len(idxs)
+            newValues.append(value)
+        return idx
+
+    def _encode(self, enc, value):
+        if enc == _STR:
+            return self._dictIdx(value, self.strIdxs, self.newStrs)
+        elif enc == _UUID:
+            return self._dictIdx(value, self.uuidIdxs, self.newUuids)
+        elif enc == _SUPPORT:
+            return value.value
+        else:
+            return value
+
+    def _writeRec(self, rec):
+        for column, enc, value in zip(self.columns, self.encs, rec):
+            column.append(self._encode(enc, value))
+        self.numRows += 1
+        if self.numRows >= self.blockSize:
+            self.flush()
+
+    def flush(self):
+        "write buffered records"
+        if self.numRows == 0:
+            return
+        strs = b"\0".join([s.encode() for s in self.newStrs])
+        parts = [_binCountStruct.pack(self.numRows),
+                 _binCountStruct.pack(len(self.newUuids))]
+        parts.extend([u.bytes for u in self.newUuids])
+        parts.append(_binStrsStruct.pack(len(self.newStrs), len(strs)))
+        parts.append(strs)
+        parts.extend([_arrayToBytes(column) for column in self.columns])
+        self.fh.write(b"".join(parts))
+        self._newBlock()
+
+
+class SupportEvalBinReader(object):
+    """Read a file created by SupportEvalBinWriter.  Values are only
+    converted to python objects once for each dictionary entry, with strings
+    interned so ids are shared across files."""
+    def __init__(self, fh):
+        self.fh = fh
+        magic, version, code = _binHeaderStruct.unpack(self._read(_binHeaderStruct.size))
+        if (magic != _binMagic) or (version != _binVersion) or (code not in _binRecClasses):
+            raise Exception("not a support evaluation binary file or wrong version: {}".format(getattr(fh, "name", fh)))
+        self.recCls = _binRecClasses[code]
+        self.encs = _binRecSpecs[self.recCls][1]
+        self.uuids = []
+        self.strs = []
+
+    def _read(self, size):
+        buf = self.fh.read(size)
+        if len(buf) != size:
+            raise Exception("truncated support evaluation binary file: {}".format(getattr(self.fh, "name", self.fh)))
+        return buf
+
+    def _readCount(self):
+        return _binCountStruct.unpack(self._read(_binCountStruct.size))[0]
+
+    def _readDicts(self):
+        numUuids = self._readCount()
+        buf = self._read(16 * numUuids)
+        self.uuids.extend([UUID(bytes=buf[i:i + 16]) for i in range(0, len(buf), 16)])
+        numStrs, strsSize = _binStrsStruct.unpack(self._read(_binStrsStruct.size))
+        if numStrs > 0:
+            self.strs.extend([sys.intern(s.decode()) for s in self._read(strsSize).split(b"\0")])
+
+    def _decodeColumn(self, enc, column):
+        if enc == _STR:
+            return [self.strs[i] if i != _binNullIdx else None for i in column]
+        elif enc == _UUID:
+            return [self.uuids[i] if i != _binNullIdx else None for i in column]
+        elif enc == _SUPPORT:
+            return [_supportByValue[v] for v in column]
+        else:
+            return column.tolist()
+
+    def _readBlock(self):
+        "returns list of columns or None on EOF"
+        buf = self.fh.read(_binCountStruct.size)
+        if len(buf) == 0:
+            return None
+        numRows = _binCountStruct.unpack(buf)[0]
+        self._readDicts()
+        columns = []
+        for enc in self.encs:
+            typecode = _binTypecodes[enc]
+            column = _arrayFromBytes(typecode, self._read(numRows * array(typecode).itemsize))
+            columns.append(self._decodeColumn(enc, column))
+        return columns
+
+    def genColumns(self):
+        "generator of blocks of records as lists of column values"
+        while True:
+            columns = self._readBlock()
+            if columns is None:
+                break
+            yield columns
+
+    def genRecDicts(self):
+        "generator of records as dicts, suitable for peewee insert_many"
+        fields = self.recCls._fields
+        for columns in self.genColumns():
+            for row in zip(*columns):
+                yield dict(zip(fields, row))
+
+    def genRecs(self):
+        "generator of records as SupportEvalResult or SupportEvidEvalResult objects"
+        for columns in self.genColumns():
+            for row in zip(*columns):
+                yield self.recCls._make(row)
+
+
+def writeSupportEvalRec(out, rec):
+    """write a SupportEvalResult or SupportEvidEvalResult to either a TSV
+    file handle or SupportEvalWriter"""
+    if isinstance(out, SupportEvalWriter):
+        out.write(rec)
+    else:
+        fileOps.prRow(out, rec.toRow())
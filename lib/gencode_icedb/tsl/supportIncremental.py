@@ -0,0 +1,143 @@
+"""
+Support for only evaluating genes that have changed between GENCODE releases.
+
+The structure of each gene (transcript exons, chromosome, strand, gene name
+and types) is reduced to a fingerprint.  Genes with the same fingerprint in
+both releases, evaluated against evidence with the same fingerprint, will
+have the same support, so the GencodeSupportEval rows from the previous
+release are copied forward, renaming the transcript ids to the new versions.
+Genes and transcripts are matched by ids without versions, as the version
+changes on modifications that don't change the structure.
+
+This assumes the evaluation code and parameters are the same for both
+releases.
+"""
+import os
+import re
+import hashlib
+from collections import namedtuple
+from pycbio.db import sqliteOps
+from gencode_icedb.general.ucscGencodeSource import GENCODE_ATTRS_TABLE, GENCODE_ANN_TABLE
+from gencode_icedb.tsl.evidenceDataDb import evidenceAlignsFiles
+from gencode_icedb.tsl.supportEvalDb import SupportEvalResult
+from gencode_icedb.tsl.tslModels import GencodeSupportEval, GencodeSupportEvidFingerprint
+
+
+def gencodeIdUnversioned(gencodeId):
+    """drop version from a GENCODE id, keeping a _PAR_Y suffix"""
+    return re.sub("\\.[0-9]+", "", gencodeId, count=1)
+
+
+def _hashFile(path, hasher):
+    with open(path, "rb") as fh:
+        hasher.update(fh.read())
+
+
+def evidenceFingerprint(evidFile):
+    """SHA1 fingerprint of an evidence file, or the strand-partitioned
+    files used in its place.  This is computed from the name, size, and
+    modification time of the data files and the contents of their tabix or
+    BAM indexes, so the data, which can be tens of gigabytes, is not read."""
+    hasher = hashlib.sha1()
+    dataFiles, indexFiles = evidenceAlignsFiles(evidFile)
+    for path in dataFiles:
+        st = os.stat(path)
+        hasher.update("{}\t{}\t{}\n".format(os.path.basename(path), st.st_size, st.st_mtime_ns).encode())
+    for path in indexFiles:
+        hasher.update(os.path.basename(path).encode())
+        _hashFile(path, hasher)
+    return hasher.hexdigest()
+
+
+class GeneFingerprint(namedtuple("GeneFingerprint",
+                                 ("geneId", "fingerprint", "transcriptIds"))):
+    """Structural fingerprint of a gene.  The transcriptIds field is a dict
+    of unversioned to versioned transcript ids."""
+    __slots__ = ()
+
+
+def _geneFingerprint(geneId, geneRows):
+    hasher = hashlib.sha1()
+    transcriptIds = {}
+    for row in sorted(geneRows, key=lambda r: (gencodeIdUnversioned(r[3]),) + tuple(str(v) for v in r[5:])):
+        transcriptIds[gencodeIdUnversioned(row[3])] = row[3]
+        hasher.update("\t".join([str(v) for v in (row[1], row[2], gencodeIdUnversioned(row[3])) + row[4:]]).encode())
+        hasher.update(b"\n")
+    return GeneFingerprint(geneId, hasher.hexdigest(), transcriptIds)
+
+
+def gencodeGeneFingerprints(gencodeDb):
+    """compute fingerprints of all genes in a GENCODE sqlite database,
+    returning a dict indexed by unversioned gene id"""
+    sql = ("SELECT attrs.geneId, attrs.geneName, attrs.geneType, attrs.transcriptId, attrs.transcriptType, "
+           "ann.chrom, ann.strand, ann.exonStarts, ann.exonEnds "
+           "FROM {attrsTbl} AS attrs, {annTbl} AS ann WHERE ann.name = attrs.transcriptId "
+           "ORDER BY attrs.geneId".format(attrsTbl=GENCODE_ATTRS_TABLE, annTbl=GENCODE_ANN_TABLE))
+    conn = sqliteOps.connect(gencodeDb, readonly=True)
+    rowsByGene = {}
+    with sqliteOps.SqliteCursor(conn) as cur:
+        cur.execute(sql)
+        for row in cur:
+            rowsByGene.setdefault(row[0], []).append(tuple(row))
+    conn.close()
+    geneFingerprints = {}
+    for geneId, geneRows in rowsByGene.items():
+        geneFingerprints[gencodeIdUnversioned(geneId)] = _geneFingerprint(geneId, geneRows)
+    return geneFingerprints
+
+
+def splitChangedGenes(prevGeneFingerprints, geneFingerprints, geneIds):
+    """Split geneIds into ones that are new or changed relative to the
+    previous release, and unchanged ones.  Returns (changedGeneIds,
+    transcriptIdMap), where transcriptIdMap is a dict of previous to current
+    transcript ids for the unchanged genes.  Ids not found in
+    geneFingerprints are treated as changed."""
+    changedGeneIds = []
+    transcriptIdMap = {}
+    for geneId in geneIds:
+        geneFp = geneFingerprints.get(gencodeIdUnversioned(geneId))
+        prevGeneFp = prevGeneFingerprints.get(gencodeIdUnversioned(geneId))
+        if (geneFp is None) or (prevGeneFp is None) or (geneFp.fingerprint != prevGeneFp.fingerprint):
+            changedGeneIds.append(geneId)
+        else:
+            for transId, prevTransId in prevGeneFp.transcriptIds.items():
+                transcriptIdMap[prevTransId] = geneFp.transcriptIds[transId]
+    return changedGeneIds, transcriptIdMap
+
+
+def getEvidFingerprints(conn, evidSetUuids):
+    """get dict of evidence set UUID to fingerprint for evidence sets in
+    the database conn; sets without fingerprints are omitted"""
+    with conn.bind_ctx([GencodeSupportEvidFingerprint]):
+        if not GencodeSupportEvidFingerprint.table_exists():
+            return {}
+        query = GencodeSupportEvidFingerprint.select().where(GencodeSupportEvidFingerprint.evidSetUuid.in_(evidSetUuids))
+        return {str(rec.evidSetUuid): rec.fingerprint for rec in query}
+
+
+def storeEvidFingerprints(conn, evidFingerprints):
+    """store dict of evidence set UUID to fingerprint in the database conn,
+    replacing existing entries for the evidence sets"""
+    with conn.bind_ctx([GencodeSupportEvidFingerprint]):
+        GencodeSupportEvidFingerprint.create_table(fail_silently=True)
+        (GencodeSupportEvidFingerprint.delete()
+         .where(GencodeSupportEvidFingerprint.evidSetUuid.in_(list(evidFingerprints.keys())))
+         .execute())
+        if len(evidFingerprints) > 0:
+            GencodeSupportEvidFingerprint.insert_many([{"evidSetUuid": evidSetUuid, "fingerprint": fingerprint}
+                                                       for evidSetUuid, fingerprint in evidFingerprints.items()]).execute()
+
+
+def copyForwardSupportEval(conn, evidSetUuids, transcriptIdMap):
+    """Generator of SupportEvalResult for the evidence sets from the database
+    conn for transcripts in transcriptIdMap, with the transcript ids renamed
+    to the current ids."""
+    with conn.bind_ctx([GencodeSupportEval]):
+        query = (GencodeSupportEval.select()
+                 .where(GencodeSupportEval.evidSetUuid.in_(evidSetUuids))
+                 .order_by(GencodeSupportEval.transcriptId, GencodeSupportEval.id))
+        for rec in query:
+            transcriptId = transcriptIdMap.get(rec.transcriptId)
+            if transcriptId is not None:
+                yield SupportEvalResult(transcriptId, rec.evidSetUuid, rec.support, rec.evidCount,
+                                        rec.offset5, rec.offset3, rec.extend5Exons, rec.extend3Exons)
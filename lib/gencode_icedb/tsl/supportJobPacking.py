@@ -0,0 +1,148 @@
+"""
+Estimate the cost of collecting support for genes and pack genes into cluster
+jobs of about the same cost, rather than a fixed number of genes per job.
+
+The cost of a gene is dominated by reading the overlapping evidence and by
+comparing each multi-exon transcript with that evidence, so it is estimated as:
+    evidCnt * (1 + multiExonTransCnt) + transCost * transCnt
+where evidCnt is the number of evidence alignments overlapping the gene, which
+is sampled from the evidence index for large genes.  Costs are in units of
+evidence alignment comparisons.  Genes that cost more than the target are split
+into jobs containing subsets of their transcripts.  Each of these jobs only
+reads the evidence overlapping the span of its own transcripts, so the
+evidence count of a split is estimated as the gene's evidence count scaled by
+the fraction of the gene's span that the split covers.
+"""
+from collections import namedtuple
+from pycbio.db import sqliteOps
+from gencode_icedb.general.ucscGencodeSource import GENCODE_ATTRS_TABLE, GENCODE_ANN_TABLE
+
+# cost of a transcript independent of the evidence
+transCost = 100
+
+# genes with a larger span have evidence counts sampled
+evidSampleWindowSize = 20000
+evidSampleWindowCnt = 4
+
+
+class TranscriptSpan(namedtuple("TranscriptSpan",
+                                ("transcriptId", "chrom", "start", "end", "exonCnt"))):
+    """location and exon count of a transcript"""
+    __slots__ = ()
+
+
+def getGeneTranscriptSpans(gencodeDb, geneIds):
+    """get dict of geneId to list of TranscriptSpan, sorted by location, for the specified genes"""
+    geneIds = frozenset(geneIds)
+    sql = ("SELECT attrs.geneId, attrs.transcriptId, ann.chrom, ann.txStart, ann.txEnd, ann.exonCount "
+           "FROM {attrsTbl} AS attrs, {annTbl} AS ann WHERE ann.name = attrs.transcriptId"
+           .format(attrsTbl=GENCODE_ATTRS_TABLE, annTbl=GENCODE_ANN_TABLE))
+    conn = sqliteOps.connect(gencodeDb, readonly=True)
+    spansByGene = {}
+    with sqliteOps.SqliteCursor(conn) as cur:
+        cur.execute(sql)
+        for row in cur:
+            if row[0] in geneIds:
+                spansByGene.setdefault(row[0], []).append(TranscriptSpan(*row[1:]))
+    conn.close()
+    for spans in spansByGene.values():
+        spans.sort(key=lambda s: (s.chrom, s.start, s.end, s.transcriptId))
+    return spansByGene
+
+
+def estimateEvidenceCount(evidenceReader, chrom, start, end):
+    """Estimate the number of alignments overlapping a range.  Large ranges
+    are estimated from counts in evenly spaced windows."""
+    span = end - start
+    if span <= evidSampleWindowSize * evidSampleWindowCnt:
+        return evidenceReader.countOverlapping(chrom, start, end)
+    step = (span - evidSampleWindowSize) // (evidSampleWindowCnt - 1)
+    cnt = 0
+    for i in range(evidSampleWindowCnt):
+        wStart = start + i * step
+        cnt += evidenceReader.countOverlapping(chrom, wStart, wStart + evidSampleWindowSize)
+    return int(cnt * span / (evidSampleWindowSize * evidSampleWindowCnt))
+
+
+def _chromSpans(transSpans):
+    "get (chrom, start, end) for each chromosome (PAR genes have two)"
+    bounds = {}
+    for ts in transSpans:
+        start, end = bounds.get(ts.chrom, (ts.start, ts.end))
+        bounds[ts.chrom] = (min(start, ts.start), max(end, ts.end))
+    return [(chrom, start, end) for chrom, (start, end) in sorted(bounds.items())]
+
+
+def _spansLength(transSpans):
+    "number of bases covered by the chromosome spans of the transcripts"
+    return sum([end - start for chrom, start, end in _chromSpans(transSpans)])
+
+
+def transcriptsCost(evidCnt, transSpans):
+    """estimated cost of evaluating the transcripts against the evidence"""
+    multiExonCnt = len([ts for ts in transSpans if ts.exonCnt > 1])
+    return evidCnt * (1 + multiExonCnt) + transCost * len(transSpans)
+
+
+class GeneCost(namedtuple("GeneCost",
+                          ("geneId", "evidCnt", "transSpans", "cost"))):
+    """estimated cost of a gene"""
+    __slots__ = ()
+
+
+def estimateGeneCost(evidenceReader, geneId, transSpans):
+    "estimate cost of a gene, returning a GeneCost"
+    evidCnt = sum([estimateEvidenceCount(evidenceReader, chrom, start, end)
+                   for chrom, start, end in _chromSpans(transSpans)])
+    return GeneCost(geneId, evidCnt, transSpans, transcriptsCost(evidCnt, transSpans))
+
+
+def splitGene(geneCost, targetCost):
+    """Split a gene into lists of transcript ids, each of which costs about
+    the target, with at least one transcript per list.  PAR transcripts on
+    two chromosomes have the same id, so ids are only included once."""
+    geneLength = _spansLength(geneCost.transSpans)
+
+    def splitCost(splitSpans):
+        evidCnt = (geneCost.evidCnt * _spansLength(splitSpans)) // geneLength if geneLength > 0 else geneCost.evidCnt
+        return transcriptsCost(evidCnt, splitSpans)
+
+    splits = []
+    splitSpans = []
+    for ts in geneCost.transSpans:
+        if (len(splitSpans) > 0) and (splitCost(splitSpans + [ts]) > targetCost):
+            splits.append(splitSpans)
+            splitSpans = []
+        splitSpans.append(ts)
+    if len(splitSpans) > 0:
+        splits.append(splitSpans)
+    seenIds = set()
+    transIdLists = []
+    for splitSpans in splits:
+        transIds = [ts.transcriptId for ts in splitSpans if ts.transcriptId not in seenIds]
+        seenIds.update(transIds)
+        if len(transIds) > 0:
+            transIdLists.append(transIds)
+    return transIdLists
+
+
+def packJobs(geneCosts, targetCost):
+    """Pack genes into jobs with a cost of about targetCost, in the order of
+    geneCosts.  Returns a list of lists of gene ids or transcript ids for
+    genes that were split."""
+    jobs = []
+    jobIds = []
+    jobCost = 0
+    for geneCost in geneCosts:
+        if geneCost.cost > targetCost:
+            jobs.extend(splitGene(geneCost, targetCost))
+            continue
+        if (len(jobIds) > 0) and (jobCost + geneCost.cost > targetCost):
+            jobs.append(jobIds)
+            jobIds = []
+            jobCost = 0
+        jobIds.append(geneCost.geneId)
+        jobCost += geneCost.cost
+    if len(jobIds) > 0:
+        jobs.append(jobIds)
+    return jobs
@@ -13,9 +13,10 @@ def setDatabaseConn(dbconn):
     _database_proxy.initialize(dbconn)
 
 
-def tslConnect(sqliteDb, create=False, readonly=True, timeout=None, synchronous=None):
+def tslConnect(sqliteDb, create=False, readonly=True, timeout=None, synchronous=None, readOnlyProfile=False):
     "connect to sqlite3 database and bind to model"
-    return peeweeConnect(sqliteDb, setDatabaseConn, create=create, readonly=readonly, timeout=timeout, synchronous=synchronous)
+    return peeweeConnect(sqliteDb, setDatabaseConn, create=create, readonly=readonly, timeout=timeout, synchronous=synchronous,
+                         readOnlyProfile=readOnlyProfile)
 
 
 def tslClose(conn):
@@ -86,3 +87,13 @@ class GencodeTranscriptSupport(BaseModel):
                                           help_text="""GENCODE TSL""")
     intLevel = IntegerField(index=True,
                             help_text="""GENCODE TSL as an integer""")
+
+
+class GencodeSupportEvidFingerprint(BaseModel):
+    """Fingerprint of the evidence used to compute the GencodeSupportEval rows
+    of an evidence set, used to determine if results can be copied forward
+    to a new GENCODE release."""
+    id = PrimaryKeyField()
+    evidSetUuid = UUIDField(unique=True,
+                            help_text="""UUID of the evidence set""")
+    fingerprint = CharField(help_text="""SHA1 of the contents of the evidence files""")
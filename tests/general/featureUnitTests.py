@@ -5,10 +5,12 @@ if __name__ == '__main__':
     sys.path = [os.path.join(rootDir, "lib"),
                 os.path.join(rootDir, "extern/pycbio/lib")] + sys.path
 import unittest
+import shutil
+import multiprocessing
 import pysam
 from pycbio.sys.objDict import ObjDict
 from pycbio.sys.testCaseBase import TestCaseBase
-from gencode_icedb.general.genome import GenomeReader
+from gencode_icedb.general.genome import GenomeReader, GenomeSharedMemory
 from gencode_icedb.general.transFeatures import ExonFeature
 from gencode_icedb.general.transFeatures import AnnotationFeature, CdsRegionFeature, Utr3RegionFeature
 from gencode_icedb.general.transFeatures import RnaInsertFeature, ChromInsertFeature
@@ -21,6 +23,7 @@ from pycbio.db import mysqlOps
 from pycbio.hgdata.genePredSqlite import GenePredSqliteTable
 from pycbio.hgdata.pslSqlite import PslSqliteTable
 from pycbio.hgdata.psl import Psl
+from pycbio.hgdata import dnaOps
 from pycbio.hgdata.genePred import GenePredReader
 from pycbio.sys.pprint2 import nswpprint
 
@@ -1320,5 +1323,52 @@ class EnsemblDbAnnotationTests(FeatureTestBase, AnnotationCheckMixin):
         self.checkENST00000538324(trans, ensChroms=True)
 
 
+def _sharedGenomeWorker(genomeFile):
+    "used to test access to shared memory from another process"
+    genomeReader = GenomeReader.getFromFileName(genomeFile)
+    try:
+        return (genomeReader.get("chr22", 100, 160), genomeReader.get("chr22", 100, 160, '-'))
+    finally:
+        genomeReader.close()
+
+
+class GenomeSharedMemoryTests(TestCaseBase):
+    @classmethod
+    def setUpClass(cls):
+        # copy so that the fasta index can be created in output
+        faFile = getOutputFile("small-chr22.fa")
+        os.makedirs(os.path.dirname(faFile), exist_ok=True)
+        shutil.copy(getInputFile("small-chr22.fa"), faFile)
+        cls.faReader = GenomeReader.getFromFileName(faFile)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.faReader.close()
+
+    def testReader(self):
+        with GenomeSharedMemory(self.faReader) as sharedGenome:
+            shmReader = GenomeReader.getFromFileName(sharedGenome.genomeFile)
+            try:
+                self.assertEqual(shmReader.getChroms(), ["chr22"])
+                self.assertTrue(shmReader.haveChrom("chr22"))
+                self.assertFalse(shmReader.haveChrom("chr1"))
+                size = self.faReader.getChromSize("chr22")
+                self.assertEqual(shmReader.getChromSize("chr22"), size)
+                self.assertEqual(shmReader.get("chr22", 0, size), self.faReader.get("chr22", 0, size))
+                self.assertEqual(shmReader.get("chr22", 100, 160, '-'),
+                                 dnaOps.reverseComplement(self.faReader.get("chr22", size - 160, size - 100)))
+            finally:
+                shmReader.close()
+
+    def testWorkers(self):
+        with GenomeSharedMemory(self.faReader, ["chr22"]) as sharedGenome:
+            with multiprocessing.Pool(2) as pool:
+                results = pool.map(_sharedGenomeWorker, 2 * [sharedGenome.genomeFile])
+        size = self.faReader.getChromSize("chr22")
+        expected = (self.faReader.get("chr22", 100, 160),
+                    dnaOps.reverseComplement(self.faReader.get("chr22", size - 160, size - 100)))
+        self.assertEqual(results, 2 * [expected])
+
+
 if __name__ == '__main__':
     unittest.main()
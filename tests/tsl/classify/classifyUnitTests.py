@@ -5,16 +5,29 @@ if __name__ == '__main__':
     sys.path = [os.path.join(rootDir, "lib"),
                 os.path.join(rootDir, "extern/pycbio/lib")] + sys.path
 import unittest
+import gzip
+import random
+import shutil
+from uuid import UUID
+import pysam
 from pycbio.sys.testCaseBase import TestCaseBase
 from pycbio.hgdata.psl import Psl
 from gencode_icedb.general.genome import GenomeReader
 from gencode_icedb.general.ucscGencodeSource import UcscGencodeReader
 from gencode_icedb.general.geneAnnot import geneAnnotGroup
 from gencode_icedb.general.evidFeatures import EvidencePslFactory
-from gencode_icedb.tsl.evidenceDataDb import evidenceAlignsReaderFactory
+from gencode_icedb.general.transFeatures import ExonFeature
+from gencode_icedb.tsl.evidenceDataDb import evidenceAlignsReaderFactory, MultiEvidenceAlignsReader
+from gencode_icedb.tsl.evidenceDataDb import evidenceAlignsIndexPsl, evidencePslStrandFiles, evidencePslTranscriptionStrand, evidenceAlignsFiles
+from gencode_icedb.tsl import minIntronSize
 from gencode_icedb.tsl.supportDefs import EvidenceType, EvidenceSupport
 from gencode_icedb.tsl.supportEval import tightExonPolymorphicSizeLimit, tightExonPolymorphicFactionLimit, EvidenceQualityEval, MegSupportEvaluator, FullLengthSupportEvaluator
-from gencode_icedb.tsl.supportEvalDb import SupportEvidEvalResult
+from gencode_icedb.tsl.supportEval import standardEvalConfigs, MultiConfigSupportEvaluator, EvidenceExonMatrix, EvidenceIntronIndex, keepEvidEval
+from gencode_icedb.tsl import supportEval
+from gencode_icedb.tsl.supportEvalDb import SupportEvidEvalResult, SupportEvalResult, SupportEvalBinWriter, SupportEvalBinReader
+from gencode_icedb.tsl.supportEvalDb import SupportEvalTsvWriter, SupportEvalRecFilter, GzipThreadWriter
+from gencode_icedb.tsl.supportJobPacking import TranscriptSpan, GeneCost, transcriptsCost, estimateEvidenceCount, splitGene, packJobs
+from gencode_icedb.tsl.supportIncremental import gencodeIdUnversioned, gencodeGeneFingerprints, splitChangedGenes, evidenceFingerprint
 
 
 genbankUuids = {
@@ -28,6 +41,8 @@ class EvidCompareTest(TestCaseBase):
     UCSC_DB = "hg38"
     EVIDENCE_DB_DIR = "output/db/evidDb"
     GENCODE_DB = "output/db/gencode.db"
+    # gene used by tests that evaluate all of a gene's transcripts
+    testGeneId = "ENSG00000186716.20"
 
     @classmethod
     def setUpClass(cls):
@@ -54,6 +69,14 @@ class EvidCompareTest(TestCaseBase):
     def _getEvaluator(cls, evidType, allowExtension):
         return cls.evaluators[(evidType, allowExtension)]
 
+    def _getTestGeneAnnots(self):
+        "gene annotations for testGeneId, grouped by locus"
+        return geneAnnotGroup(self.gencodeReader.getByGeneId(self.testGeneId))
+
+    def _getTestGeneEvid(self, geneAnnot, evidType=EvidenceType.RNA):
+        "multi-exon evidence of evidType overlapping geneAnnot"
+        return list(self.evidenceReaders[evidType].genOverlapping(geneAnnot.chrom, geneAnnot.transcriptionStrand, minExons=2))
+
     def _getAnnot(self, transId):
         annots = self.gencodeReader.getByTranscriptIds(transId)
         if len(annots) == 0:
@@ -107,7 +130,7 @@ class EvidCompareTest(TestCaseBase):
         self._evalGeneTest("ENSG00000215568.8")
 
     def testBCR(self):
-        self._evalGeneTest("ENSG00000186716.20")
+        self._evalGeneTest(self.testGeneId)
 
     def testIL17RA(self):
         self._evalGeneTest("ENSG00000177663.13")
@@ -116,6 +139,230 @@ class EvidCompareTest(TestCaseBase):
         # PAR gene
         self._evalGeneTest("ENSG00000185960.14")
 
+    def _evalGeneRows(self, evaluators, geneAnnots):
+        outSupportTsv = self.getOutputFile(".support.tsv")
+        with open(outSupportTsv, 'w') as evalTsvFh:
+            for geneAnnot in geneAnnots:
+                for evaluator in evaluators:
+                    evaluator.evaluateGeneTranscripts(geneAnnot, evalTsvFh)
+        with open(outSupportTsv) as evalTsvFh:
+            return sorted(evalTsvFh.readlines())
+
+    def testMultiEvidSets(self):
+        # one pass over both sets must match separate passes
+        geneAnnots = self._getTestGeneAnnots()
+        multiReader = MultiEvidenceAlignsReader([self.evidenceReaders[EvidenceType.RNA],
+                                                 self.evidenceReaders[EvidenceType.EST]])
+        self.assertEqual(multiReader.evidSetUuids, (genbankUuids[EvidenceType.RNA], genbankUuids[EvidenceType.EST]))
+        multiRows = self._evalGeneRows([FullLengthSupportEvaluator(multiReader, self.qualEval)], geneAnnots)
+        singleRows = self._evalGeneRows([FullLengthSupportEvaluator(self.evidenceReaders[EvidenceType.RNA], self.qualEval),
+                                         FullLengthSupportEvaluator(self.evidenceReaders[EvidenceType.EST], self.qualEval)],
+                                        geneAnnots)
+        self.assertEqual(multiRows, singleRows)
+
+    def testMultiConfig(self):
+        # one pass over multiple configurations must match separate passes
+        geneAnnots = self._getTestGeneAnnots()
+        evidenceReader = self.evidenceReaders[EvidenceType.RNA]
+        configs = [standardEvalConfigs["tight_extend"], standardEvalConfigs["loose"]]
+        outTsvs = {config.configId: self.getOutputFile("." + config.configId + ".support.tsv") for config in configs}
+        multiEvaluator = MultiConfigSupportEvaluator(evidenceReader, configs)
+        with open(outTsvs["tight_extend"], "w") as tightFh, open(outTsvs["loose"], "w") as looseFh:
+            outputs = {"tight_extend": (tightFh, None), "loose": (looseFh, None)}
+            for geneAnnot in geneAnnots:
+                multiEvaluator.evaluateGeneTranscripts(geneAnnot, outputs)
+        for config in configs:
+            with open(outTsvs[config.configId]) as fh:
+                multiRows = sorted(fh.readlines())
+            evaluator = FullLengthSupportEvaluator(evidenceReader, config.qualEval, config.allowExtension)
+            self.assertEqual(multiRows, self._evalGeneRows([evaluator], geneAnnots))
+
+    def testBinaryOutput(self):
+        # binary results and details must match TSV
+        geneAnnot = self._getTestGeneAnnots()[0]
+        evaluator = FullLengthSupportEvaluator(self.evidenceReaders[EvidenceType.RNA], self.qualEval)
+        outFiles = {ext: (self.getOutputFile(".support" + ext), self.getOutputFile(".details" + ext)) for ext in (".tsv", ".bin")}
+        with open(outFiles[".tsv"][0], "w") as evalTsvFh, open(outFiles[".tsv"][1], "w") as detailsTsvFh:
+            evaluator.writeTsvHeaders(evalTsvFh, detailsTsvFh)
+            evaluator.evaluateGeneTranscripts(geneAnnot, evalTsvFh, detailsTsvFh)
+        with open(outFiles[".bin"][0], "wb") as evalBinFh, open(outFiles[".bin"][1], "wb") as detailsBinFh:
+            with SupportEvalBinWriter(evalBinFh, SupportEvalResult, blockSize=7) as evalWriter, \
+                    SupportEvalBinWriter(detailsBinFh, SupportEvidEvalResult, blockSize=7) as detailsWriter:
+                evaluator.evaluateGeneTranscripts(geneAnnot, evalWriter, detailsWriter)
+        for tsvFile, binFile in zip(*outFiles.values()):
+            with open(tsvFile) as fh:
+                tsvRows = [line[0:-1].split("\t") for line in fh][1:]
+            with open(binFile, "rb") as fh:
+                binRows = [rec.toRow() for rec in SupportEvalBinReader(fh).genRecs()]
+            self.assertGreater(len(binRows), 0)
+            self.assertEqual(binRows, tsvRows)
+
+    def testDetailsFilter(self):
+        # filtered details written in batches through gzip thread must match filtering all details
+        geneAnnot = self._getTestGeneAnnots()[0]
+        evaluator = FullLengthSupportEvaluator(self.evidenceReaders[EvidenceType.RNA], self.qualEval)
+        detailsTsv = self.getOutputFile(".details.tsv")
+        filteredTsv = self.getOutputFile(".filtered-details.tsv.gz")
+        with open(self.getOutputFile(".support.tsv"), "w") as evalTsvFh, open(detailsTsv, "w") as detailsTsvFh:
+            evaluator.evaluateGeneTranscripts(geneAnnot, evalTsvFh, detailsTsvFh)
+        recFilter = SupportEvalRecFilter(supports=[EvidenceSupport.good, EvidenceSupport.polymorphic], sampleFraction=0.5)
+        with open(self.getOutputFile(".support.tsv"), "w") as evalTsvFh, GzipThreadWriter(filteredTsv) as detailsFh:
+            with SupportEvalTsvWriter(detailsFh, SupportEvidEvalResult, batchSize=3, recFilter=recFilter) as detailsWriter:
+                evaluator.evaluateGeneTranscripts(geneAnnot, evalTsvFh, detailsWriter)
+        with open(detailsTsv) as fh:
+            expectRows = [row for row in [line[0:-1].split("\t") for line in fh][1:]
+                          if recFilter.keep(SupportEvidEvalResult(*row))]
+        with gzip.open(filteredTsv, "rt") as fh:
+            filteredRows = [line[0:-1].split("\t") for line in fh][1:]
+        self.assertGreater(len(filteredRows), 0)
+        self.assertEqual(filteredRows, expectRows)
+
+    def testFastResultConstructor(self):
+        evidSetUuid = genbankUuids[EvidenceType.RNA]
+        evr = SupportEvidEvalResult.fromTyped("ENST00000334109.2", UUID(evidSetUuid), "AK056283.1", EvidenceSupport.good, 1, 2, 0, 3)
+        self.assertEqual(evr, SupportEvidEvalResult("ENST00000334109.2", evidSetUuid, "AK056283.1", "good", "1", "2", "0", "3"))
+        self.assertFalse(hasattr(evr, "__dict__"))
+        er = SupportEvalResult.fromTyped("ENST00000334109.2", UUID(evidSetUuid), EvidenceSupport.good, 2, 1, 2)
+        self.assertEqual(er, SupportEvalResult("ENST00000334109.2", evidSetUuid, "good", "2", "1", "2"))
+        transcriptId = "".join(["ENST00000334109", ".2"])  # not a literal, so not already interned
+        self.assertIs(SupportEvalResult.fromTyped(transcriptId, UUID(evidSetUuid), EvidenceSupport.good, 2, 1, 2).transcriptId, er.transcriptId)
+
+    def testCompareMatrix(self):
+        # array comparison must match comparing one at a time
+        geneAnnot = self._getTestGeneAnnots()[0]
+        evidCache = self._getTestGeneEvid(geneAnnot)
+        evidMatrix = EvidenceExonMatrix(evidCache)
+        for allowExtension in (True, False):
+            evaluator = self._getEvaluator(EvidenceType.RNA, allowExtension)
+            for transAnnot in geneAnnot.transcripts:
+                if len(transAnnot.getFeaturesOfType(ExonFeature)) > 1:
+                    self.assertEqual(evaluator.compareMatrix(transAnnot, evidMatrix, list(range(len(evidCache)))),
+                                     [evaluator.compare(transAnnot, evidTrans) for evidTrans in evidCache])
+
+    def testPruning(self):
+        # pruning evidence that can't support a transcript must not change results
+        geneAnnot = self._getTestGeneAnnots()[0]
+        evaluator = FullLengthSupportEvaluator(self.evidenceReaders[EvidenceType.RNA], self.qualEval, allowExtension=True)
+        evidCache = evaluator.getEvidenceCache(geneAnnot)
+        evidIndex = EvidenceIntronIndex(evidCache)
+        evidMatrix = EvidenceExonMatrix(evidCache)
+        for allowExtension in (True, False):
+            megEvaluator = self._getEvaluator(EvidenceType.RNA, allowExtension)
+            for transAnnot in geneAnnot.transcripts:
+                if len(transAnnot.getFeaturesOfType(ExonFeature)) > 1:
+                    candidateIdxs = frozenset(evidIndex.getCandidateIdxs(transAnnot))
+                    prunedIdxs = [iEvid for iEvid in range(len(evidCache)) if iEvid not in candidateIdxs]
+                    prunedResults = megEvaluator.prunedResults(transAnnot, evidMatrix, prunedIdxs)
+                    self.assertEqual(prunedResults, [megEvaluator.compare(transAnnot, evidCache[iEvid]) for iEvid in prunedIdxs])
+                    self.assertFalse(any([keepEvidEval(evr.support) for evr in prunedResults]))
+
+        # details are written for pruned evidence, without disabling pruning
+        prunedRows = self._evalGeneRows([evaluator], [geneAnnot])
+        prunedCnt = evaluator.prunedCnt
+        self.assertGreater(prunedCnt, 0)
+        outSupportTsv = self.getOutputFile(".support.tsv")
+        outDetailsTsv = self.getOutputFile(".details.tsv")
+        with open(outSupportTsv, 'w') as evalTsvFh, open(outDetailsTsv, 'w') as detailsTsvFh:
+            evaluator.evaluateGeneTranscripts(geneAnnot, evalTsvFh, detailsTsvFh)
+        self.assertEqual(evaluator.prunedCnt, 2 * prunedCnt)
+        with open(outSupportTsv) as evalTsvFh:
+            self.assertEqual(sorted(evalTsvFh.readlines()), prunedRows)
+        with open(outDetailsTsv) as detailsTsvFh:
+            self.assertGreaterEqual(len(detailsTsvFh.readlines()), prunedCnt)
+
+    def testQualityCache(self):
+        # evidence quality should only be checked once per gene
+        geneAnnot = self._getTestGeneAnnots()[0]
+        evaluator = FullLengthSupportEvaluator(self.evidenceReaders[EvidenceType.RNA], self.qualEval)
+        # details causes the quality of all evidence to be checked, including pruned
+        with open(self.getOutputFile(".support.tsv"), 'w') as evalTsvFh, open(self.getOutputFile(".details.tsv"), 'w') as detailsTsvFh:
+            evaluator.evaluateGeneTranscripts(geneAnnot, evalTsvFh, detailsTsvFh)
+        qualCheckCnt, qualCacheHitCnt = evaluator.getQualityCheckCounts()
+        self.assertEqual(qualCheckCnt, len(evaluator.getEvidenceCache(geneAnnot)))
+        self.assertGreater(qualCacheHitCnt, 0)
+
+    def testQualityCacheBounded(self):
+        # direct compare() calls must not grow the quality cache without bound
+        geneAnnot = self._getTestGeneAnnots()[0]
+        transAnnot = [t for t in geneAnnot.transcripts if len(t.getFeaturesOfType(ExonFeature)) > 1][0]
+        evidCache = self._getTestGeneEvid(geneAnnot)
+        evaluator = MegSupportEvaluator(genbankUuids[EvidenceType.RNA], self.qualEval)
+        saveQualCacheSize = supportEval.qualCacheSize
+        supportEval.qualCacheSize = 4
+        try:
+            for rep in range(2):
+                for evidTrans in evidCache:
+                    evaluator.compare(transAnnot, evidTrans)
+        finally:
+            supportEval.qualCacheSize = saveQualCacheSize
+        self.assertEqual(len(evaluator.qualCache), min(4, len(evidCache)))
+        # alignments at the same location are distinct, as they may differ in indels
+        evaluator.clearQualityCache()
+        for evidTrans in evidCache:
+            evaluator.compare(transAnnot, evidTrans)
+        checkCnt = evaluator.qualCheckCnt
+        for evidTrans in self._getTestGeneEvid(geneAnnot):
+            evaluator.compare(transAnnot, evidTrans)
+        self.assertEqual(evaluator.qualCheckCnt, checkCnt + len(evidCache))
+
+    def _mkStrandPartitioned(self, evidType):
+        "create strand-partitioned version of evidence PSL"
+        outPslFile = self.getOutputFile(".psl.gz")
+        strandPslFiles = evidencePslStrandFiles(outPslFile)
+        strandFhs = {strand: open(os.path.splitext(strandPslFile)[0], "w") for strand, strandPslFile in strandPslFiles.items()}
+        with gzip.open(os.path.join(self.EVIDENCE_DB_DIR, "GenBank-" + str(evidType) + ".psl.gz"), "rt") as pslFh:
+            for line in pslFh:
+                strandFhs[evidencePslTranscriptionStrand(line.split('\t')[8])].write(line)
+        for strand, strandPslFile in strandPslFiles.items():
+            strandFhs[strand].close()
+            pysam.tabix_compress(os.path.splitext(strandPslFile)[0], strandPslFile, force=True)
+            evidenceAlignsIndexPsl(strandPslFile)
+        return outPslFile
+
+    def testStrandPartitioned(self):
+        # must return the same alignments as the unpartitioned file
+        evidType = EvidenceType.EST
+        strandedReader = evidenceAlignsReaderFactory(genbankUuids[evidType], self._mkStrandPartitioned(evidType), self.genomeReader)
+        try:
+            geneAnnot = self._getTestGeneAnnots()[0]
+            for transcriptionStrand in (None, '+', '-'):
+                self.assertEqual(sorted([t.rna.name for t in strandedReader.genOverlapping(geneAnnot.chrom, transcriptionStrand)]),
+                                 sorted([t.rna.name for t in self.evidenceReaders[evidType].genOverlapping(geneAnnot.chrom, transcriptionStrand)]))
+        finally:
+            strandedReader.close()
+
+    def testIncrementalFingerprints(self):
+        geneId = self.testGeneId
+        self.assertEqual(gencodeIdUnversioned("ENST00000359761.7_PAR_Y"), "ENST00000359761_PAR_Y")
+        geneFingerprints = gencodeGeneFingerprints(self.GENCODE_DB)
+        geneFp = geneFingerprints[gencodeIdUnversioned(geneId)]
+        self.assertEqual(geneFp.geneId, geneId)
+        self.assertEqual(sorted(geneFp.transcriptIds.values()),
+                         sorted(set([t.rna.name for t in self.gencodeReader.getByGeneId(geneId)])))
+        # unchanged gene is copied forward with the same ids
+        changedGeneIds, transcriptIdMap = splitChangedGenes(geneFingerprints, geneFingerprints, [geneId])
+        self.assertEqual(changedGeneIds, [])
+        self.assertEqual(transcriptIdMap, {t: t for t in geneFp.transcriptIds.values()})
+        # changed structure, or new gene, is evaluated
+        prevGeneFingerprints = dict(geneFingerprints)
+        prevGeneFingerprints[gencodeIdUnversioned(geneId)] = geneFp._replace(fingerprint="changed")
+        self.assertEqual(splitChangedGenes(prevGeneFingerprints, geneFingerprints, [geneId]), ([geneId], {}))
+        self.assertEqual(splitChangedGenes({}, geneFingerprints, [geneId]), ([geneId], {}))
+
+    def testEvidenceFingerprint(self):
+        # fingerprint is from file metadata and index, not the data
+        pslFile = self.getOutputFile(".psl.gz")
+        shutil.copy(os.path.join(self.EVIDENCE_DB_DIR, "GenBank-RNA.psl.gz"), pslFile)
+        shutil.copy(os.path.join(self.EVIDENCE_DB_DIR, "GenBank-RNA.psl.gz.tbi"), pslFile + ".tbi")
+        self.assertEqual(evidenceAlignsFiles(pslFile), ([pslFile], [pslFile + ".tbi"]))
+        fingerprint = evidenceFingerprint(pslFile)
+        self.assertEqual(evidenceFingerprint(pslFile), fingerprint)
+        st = os.stat(pslFile)
+        os.utime(pslFile, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+        self.assertNotEqual(evidenceFingerprint(pslFile), fingerprint)
+        os.utime(pslFile, ns=(st.st_atime_ns, st.st_mtime_ns))
+        self.assertEqual(evidenceFingerprint(pslFile), fingerprint)
+
     def testExtendWithTwoExonsOverInitial(self):
         # EST AA227241.1 has two 5' exons overlapping 5' exon, caused failure with allowExtension
         annotName = "ENST00000489867.2"
@@ -220,9 +467,152 @@ class EvidCompareTest(TestCaseBase):
         self.assertEqual(evidSupport.support, EvidenceSupport.feat_mismatch)
 
 
+class JobPackingTest(TestCaseBase):
+    """job cost estimation and packing"""
+    class FakeEvidenceReader(object):
+        "one alignment starting every 100 bases"
+        def countOverlapping(self, chrom, start, end):
+            return (end - start) // 100
+
+    @staticmethod
+    def _mkGeneCost(geneId, evidCnt, transCnt):
+        transSpans = [TranscriptSpan("{}.T{}".format(geneId, i), "chr1", 0, 1000, 2) for i in range(transCnt)]
+        return GeneCost(geneId, evidCnt, transSpans, transcriptsCost(evidCnt, transSpans))
+
+    def testEstimateEvidenceCount(self):
+        rdr = self.FakeEvidenceReader()
+        self.assertEqual(estimateEvidenceCount(rdr, "chr1", 1000, 51000), 500)
+        # sampled
+        self.assertEqual(estimateEvidenceCount(rdr, "chr1", 1000, 2001000), 20000)
+
+    def testSplitGene(self):
+        geneCost = self._mkGeneCost("G1", 1000, 10)
+        splits = splitGene(geneCost, 5000)
+        self.assertEqual(sum(splits, []), [ts.transcriptId for ts in geneCost.transSpans])
+        self.assertEqual([len(s) for s in splits], [3, 3, 3, 1])
+
+    def testSplitGeneSpans(self):
+        # each split only reads the evidence for its transcripts, so
+        # transcripts at the ends of a long gene are cheaper to split
+        transSpans = ([TranscriptSpan("G1.T{}".format(i), "chr1", 0, 1000, 2) for i in range(5)]
+                      + [TranscriptSpan("G1.T{}".format(i), "chr1", 9000, 10000, 2) for i in range(5, 10)])
+        geneCost = GeneCost("G1", 1000, transSpans, transcriptsCost(1000, transSpans))
+        splits = splitGene(geneCost, 1200)
+        self.assertEqual(sum(splits, []), [ts.transcriptId for ts in transSpans])
+        self.assertEqual([len(s) for s in splits], [5, 5])
+
+    def testPackJobs(self):
+        geneCosts = [self._mkGeneCost("G1", 10, 1), self._mkGeneCost("G2", 10, 1),
+                     self._mkGeneCost("G3", 1000, 10), self._mkGeneCost("G4", 10, 1)]
+        jobs = packJobs(geneCosts, 5000)
+        self.assertEqual(jobs, [["G3.T0", "G3.T1", "G3.T2"], ["G3.T3", "G3.T4", "G3.T5"],
+                                ["G3.T6", "G3.T7", "G3.T8"], ["G3.T9"], ["G1", "G2", "G4"]])
+
+
+class CompareMatrixRandomTest(TestCaseBase):
+    """compareMatrix must match compare() on randomized exon structures,
+    including evidence that extends the annotation and evidence that runs
+    out of exons, which falls back to compare()"""
+    seed = 3141
+    annotCnt = 60
+    evidPerAnnot = 30
+
+    @staticmethod
+    def _mkTrans(name, strand, blocks):
+        "build a TranscriptFeatures object from list of (tStart, tEnd) blocks"
+        sizes = [end - start for start, end in blocks]
+        qSize = sum(sizes)
+        qStarts = [sum(sizes[0:i]) for i in range(len(sizes))]
+        row = [qSize, 0, 0, 0, 0, 0, 0, 0, strand, name, qSize, 0, qSize,
+               "chr1", 10000000, blocks[0][0], blocks[-1][1], len(blocks),
+               ",".join([str(v) for v in sizes]) + ",",
+               ",".join([str(v) for v in qStarts]) + ",",
+               ",".join([str(start) for start, end in blocks]) + ","]
+        return EvidencePslFactory().fromPsl(Psl.fromRow([str(v) for v in row]))
+
+    @staticmethod
+    def _mkAnnotExons(rand):
+        exons = []
+        start = rand.randint(10000, 20000)
+        for i in range(rand.randint(2, 6)):
+            end = start + rand.randint(40, 300)
+            exons.append((start, end))
+            start = end + rand.randint(minIntronSize + 20, 2000)
+        return exons
+
+    @staticmethod
+    def _shift(rand):
+        return rand.choice((0, 0, rand.randint(-15, 15)))
+
+    def _mkEvidExons(self, rand, annotExons):
+        exons = list(annotExons)
+        # terminal boundaries and extension
+        for i in range(rand.choice((0, 0, 1, 2))):
+            exons.insert(0, (exons[0][0] - rand.randint(200, 500), exons[0][0] - rand.randint(100, 150)))
+        for i in range(rand.choice((0, 0, 1, 2))):
+            exons.append((exons[-1][1] + rand.randint(100, 150), exons[-1][1] + rand.randint(200, 500)))
+        iFirst = exons.index(annotExons[0])
+        iLast = iFirst + len(annotExons) - 1
+        exons[iFirst] = (exons[iFirst][0] + self._shift(rand), exons[iFirst][1])
+        exons[iLast] = (exons[iLast][0], exons[iLast][1] + self._shift(rand))
+        # internal boundary mismatch
+        if rand.random() < 0.2:
+            i = rand.randrange(len(exons))
+            exons[i] = (exons[i][0] + self._shift(rand), exons[i][1] + self._shift(rand))
+        # retained intron
+        if (len(exons) > 2) and (rand.random() < 0.3):
+            i = rand.randrange(len(exons) - 1)
+            exons[i:i + 2] = [(exons[i][0], exons[i + 1][1])]
+        # truncated
+        if (len(exons) > 2) and (rand.random() < 0.2):
+            exons = exons[1:] if rand.random() < 0.5 else exons[:-1]
+        return exons
+
+    @staticmethod
+    def _mkBlocks(rand, exons):
+        "split exons into blocks, sometimes with indels"
+        blocks = []
+        for start, end in exons:
+            if ((end - start) > 60) and (rand.random() < 0.1):
+                mid = start + (end - start) // 2
+                blocks.extend([(start, mid), (mid + rand.choice((3, 20)), end)])
+            else:
+                blocks.append((start, end))
+        return blocks
+
+    def testRandomCompare(self):
+        rand = random.Random(self.seed)
+        qualEval = EvidenceQualityEval(tightExonPolymorphicSizeLimit, tightExonPolymorphicFactionLimit)
+        evaluators = [MegSupportEvaluator(genbankUuids[EvidenceType.RNA], qualEval, allowExtension=allowExtension)
+                      for allowExtension in (True, False)]
+        fallbackCnt = 0
+        supports = set()
+        for iAnnot in range(self.annotCnt):
+            strand = rand.choice(("+", "-"))
+            annotExons = self._mkAnnotExons(rand)
+            transAnnot = self._mkTrans("annot{}".format(iAnnot), strand, annotExons)
+            evidCache = [self._mkTrans("evid{}.{}".format(iAnnot, iEvid), strand,
+                                       self._mkBlocks(rand, self._mkEvidExons(rand, annotExons)))
+                         for iEvid in range(self.evidPerAnnot)]
+            evidMatrix = EvidenceExonMatrix(evidCache)
+            evidIdxs = list(range(len(evidCache)))
+            for evaluator in evaluators:
+                results = evaluator.compareMatrix(transAnnot, evidMatrix, evidIdxs)
+                self.assertEqual(results, [evaluator.compare(transAnnot, evidTrans) for evidTrans in evidCache])
+                supports.update([evr.support for evr in results])
+                fallbackCnt += len([r for r in evaluator._compareMatrixImpl(transAnnot, transAnnot.getFeaturesOfType(ExonFeature),
+                                                                            evidMatrix, evidIdxs) if r is None])
+        self.assertGreater(fallbackCnt, 0)
+        for support in (EvidenceSupport.good, EvidenceSupport.polymorphic, EvidenceSupport.extends_exons,
+                        EvidenceSupport.large_indel_size, EvidenceSupport.feat_count_mismatch, EvidenceSupport.feat_mismatch):
+            self.assertIn(support, supports)
+
+
 def suite():
     ts = unittest.TestSuite()
     ts.addTest(unittest.makeSuite(EvidCompareTest))
+    ts.addTest(unittest.makeSuite(JobPackingTest))
+    ts.addTest(unittest.makeSuite(CompareMatrixRandomTest))
     return ts
 
 
@@ -0,0 +1,66 @@
+import sys
+import os
+if __name__ == '__main__':
+    rootDir = "../../.."
+    sys.path = [os.path.join(rootDir, "lib"),
+                os.path.join(rootDir, "extern/pycbio/lib")] + sys.path
+import unittest
+from pycbio.sys.testCaseBase import TestCaseBase
+from gencode_icedb.tsl.supportDefs import EvidenceType, EvidenceSupport, TrascriptionSupportLevel
+from gencode_icedb.tsl.tslModels import tslConnect, tslClose, GencodeSupportEval, GencodeTranscriptSupport
+from gencode_icedb.tsl.supportClassify import SupportClassifier
+
+rnaUuid = "02c995e3-372c-4cde-b216-5d3376c51988"
+estUuid = "fcfc5121-7e07-42f6-93a2-331a513eeb2c"
+otherUuid = "f108c86b-8e0b-4dbd-96ae-6e75d8566eac"
+
+
+def _mkEval(transcriptId, evidSetUuid, support, evidCount):
+    return {"transcriptId": transcriptId, "evidSetUuid": evidSetUuid, "support": support,
+            "evidCount": evidCount, "offset5": 0, "offset3": 0, "extend5Exons": 0, "extend3Exons": 0}
+
+
+class SupportClassifyTests(TestCaseBase):
+    @classmethod
+    def setUpClass(cls):
+        cls.conn = tslConnect("sqlite://", create=True, readonly=False)
+        GencodeSupportEval.create_table()
+        evals = [
+            _mkEval("T1.1", rnaUuid, EvidenceSupport.good, 2),
+            _mkEval("T1.1", estUuid, EvidenceSupport.good, 1),
+            _mkEval("T2.1", rnaUuid, EvidenceSupport.no_support, 0),
+            _mkEval("T2.1", estUuid, EvidenceSupport.polymorphic, 1),
+            _mkEval("T2.1", estUuid, EvidenceSupport.good, 2),
+            _mkEval("T3.1", rnaUuid, EvidenceSupport.extends_exons, 3),
+            _mkEval("T3.1", estUuid, EvidenceSupport.good, 1),
+            _mkEval("T4.1", rnaUuid, EvidenceSupport.no_support, 0),
+            _mkEval("T4.1", otherUuid, EvidenceSupport.good, 5),
+            _mkEval("T5.1", rnaUuid, EvidenceSupport.no_eval_single_exon, 0),
+        ]
+        with cls.conn.atomic():
+            GencodeSupportEval.insert_many(evals).execute()
+
+    @classmethod
+    def tearDownClass(cls):
+        tslClose(cls.conn)
+
+    def testClassify(self):
+        classifier = SupportClassifier(self.conn, {rnaUuid: EvidenceType.RNA, estUuid: EvidenceType.EST})
+        classifier.store(["T1.1", "T2.1", "T3.1", "T4.1", "T5.1", "T6.1"])
+        levels = {r.transcriptId: r.level for r in GencodeTranscriptSupport.select()}
+        self.assertEqual(levels, {"T1.1": TrascriptionSupportLevel.tsl1,
+                                  "T2.1": TrascriptionSupportLevel.tsl2,
+                                  "T3.1": TrascriptionSupportLevel.tsl3,
+                                  "T4.1": TrascriptionSupportLevel.tsl5,
+                                  "T5.1": TrascriptionSupportLevel.tslNA,
+                                  "T6.1": TrascriptionSupportLevel.tslNA})
+
+
+def suite():
+    ts = unittest.TestSuite()
+    ts.addTest(unittest.makeSuite(SupportClassifyTests))
+    return ts
+
+
+if __name__ == '__main__':
+    unittest.main()
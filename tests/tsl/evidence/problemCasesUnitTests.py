@@ -0,0 +1,64 @@
+import sys
+import os
+if __name__ == '__main__':
+    rootDir = "../../.."
+    sys.path = [os.path.join(rootDir, "lib"),
+                os.path.join(rootDir, "extern/pycbio/lib")] + sys.path
+import unittest
+from pycbio.sys.testCaseBase import TestCaseBase
+from pycbio.tsv import TsvReader
+from pycbio.db import sqliteOps
+from gencode_icedb.tsl.supportDefs import GenbankProblemReason
+from gencode_icedb.tsl.genbankProblemCasesSqlite import GenbankProblemCaseSqliteTable
+from gencode_icedb.tsl.genbankProblemCases import GenbankProblemCases
+
+
+class ProblemCasesTests(TestCaseBase):
+    PROBLEM_CASES_TSV = "expected/hs.problemCasesParseTest.tsv"
+
+    @classmethod
+    def setUpClass(cls):
+        cls.conn = sqliteOps.connect(None)
+        dbTbl = GenbankProblemCaseSqliteTable(cls.conn, create=True)
+        dbTbl.loads([row.getRow() for row in TsvReader(cls.PROBLEM_CASES_TSV)])
+        # overlapping range, lowest reason wins
+        dbTbl.loads([("hs", "EST", "BG217800", "BG217899", "orestes")])
+        cls.problemCases = GenbankProblemCases(cls.conn)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.close()
+
+    def testSingle(self):
+        self.assertEqual(self.problemCases.getProblem("AK074070.1"), GenbankProblemReason.nedo)
+        self.assertIsNone(self.problemCases.getProblem("AK074069.1"))
+        self.assertIsNone(self.problemCases.getProblem("AK074071.1"))
+
+    def testRange(self):
+        self.assertEqual(self.problemCases.getProblem("BG217841.1"), GenbankProblemReason.athRage)
+        self.assertEqual(self.problemCases.getProblem("BG217842.2"), GenbankProblemReason.athRage)
+        self.assertEqual(self.problemCases.getProblem("BG217843.1"), GenbankProblemReason.orestes)
+        self.assertEqual(self.problemCases.getProblem("BG217800.1"), GenbankProblemReason.orestes)
+        self.assertIsNone(self.problemCases.getProblem("BG217900.1"))
+
+    def testOtherGroups(self):
+        # different prefix or length
+        self.assertIsNone(self.problemCases.getProblem("AK07407.1"))
+        self.assertIsNone(self.problemCases.getProblem("NM_074070.1"))
+        self.assertFalse(self.problemCases.isProblem("ZZ000001.1"))
+
+    def testCached(self):
+        self.problemCases.getProblem("CU453739.1")
+        hits = self.problemCases.cacheInfo().hits
+        self.assertEqual(self.problemCases.getProblem("CU453739.2"), GenbankProblemReason.orestes)
+        self.assertEqual(self.problemCases.cacheInfo().hits, hits + 1)
+
+
+def suite():
+    ts = unittest.TestSuite()
+    ts.addTest(unittest.makeSuite(ProblemCasesTests))
+    return ts
+
+
+if __name__ == '__main__':
+    unittest.main()